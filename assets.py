@@ -0,0 +1,180 @@
+from __future__ import division
+"""
+Builds the game's models on worker threads, and uploads them a slice at a time.
+
+Every model read from a file is registered here, with a function that builds
+it without touching GL: parsing its obj file and materials and packing its
+triangles. start() sets worker threads building them all, in the order they
+were registered. At startup that overlaps with opening the window, and after
+that with play.
+
+Only the thread with the GL context may upload them, so Game.draw calls
+upload() every frame. It sends at most SLICE bytes, so a big model is spread
+over several frames instead of holding one up. A model is handed out by get()
+only once all of it is uploaded.
+
+A model asked for before it's ready is finished then and there, waiting for
+its worker if it's still being built, or building it on the spot if no worker
+has got to it yet. The ship and asteroids are needed that early, at startup.
+The aliens' model isn't needed until ALIEN_INTERVAL ticks into the first
+level, and is long done by then, so no frame of play waits on a file.
+
+mark() notes when things happen, like startup finishing and the first frame
+being drawn, and report() gives those along with how long each model took.
+
+"""
+import threading
+import timeit
+import Queue
+
+import util
+
+WORKERS = 2
+
+# Bytes uploaded per frame at most
+SLICE = 64 * 1024
+
+_timer = timeit.default_timer
+
+class _Asset(object):
+    def __init__(self, name, build):
+        self.name = name
+        self.build = build
+        self.model = None
+        # What building it raised, raised again by get()
+        self.error = None
+        # Whether someone is building it, or has built it
+        self.claimed = False
+        self.built = threading.Event()
+        self.ready = False
+
+        # Seconds building it, uploading it, and waiting for it to be ready
+        self.build_time = 0
+        self.upload_time = 0
+        self.wait_time = 0
+        self.slices = 0
+
+class Assets(object):
+    def __init__(self):
+        self._assets = {}
+        # Registered, and not yet ready, in order
+        self._order = []
+        self._pending = []
+        self._lock = threading.Lock()
+        self._queue = Queue.Queue()
+        self._workers = []
+        self._marks = [("start", _timer())]
+
+    def register(self, name, build):
+        """Adds a model, built by calling build(), which must not touch GL.
+        It should make the model with upload=False. A name already registered
+        is left as it is"""
+        if name in self._assets:
+            return
+        asset = _Asset(name, build)
+        self._assets[name] = asset
+        self._order.append(asset)
+        self._pending.append(asset)
+        if self._workers:
+            self._queue.put(asset)
+
+    def start(self, workers=WORKERS):
+        """Starts building everything registered in the background. Does
+        nothing if already started, or when headless"""
+        if self._workers or util.headless:
+            return
+        for asset in self._order:
+            self._queue.put(asset)
+        for i in xrange(workers):
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def _work(self):
+        """A worker thread"""
+        while True:
+            self._build(self._queue.get())
+
+    def _build(self, asset):
+        """Builds asset, unless someone else already is"""
+        with self._lock:
+            if asset.claimed:
+                return
+            asset.claimed = True
+        start = _timer()
+        try:
+            asset.model = asset.build()
+        except Exception as e:
+            asset.error = e
+        asset.build_time = _timer() - start
+        asset.built.set()
+
+    def upload(self, limit=SLICE):
+        """Uploads up to limit bytes of models that have been built. Call it
+        from the GL thread"""
+        for asset in list(self._pending):
+            if limit <= 0:
+                break
+            if not asset.built.is_set() or asset.error is not None:
+                continue
+            start = _timer()
+            limit -= asset.model.upload(limit)
+            asset.upload_time += _timer() - start
+            asset.slices += 1
+            if asset.model.pending is None:
+                self._ready(asset)
+
+    def _ready(self, asset):
+        asset.ready = True
+        self._pending.remove(asset)
+
+    def get(self, name):
+        """The finished model registered as name. If it isn't ready, finishes
+        it now"""
+        asset = self._assets[name]
+        if not asset.ready:
+            start = _timer()
+            self._build(asset)
+            asset.built.wait()
+            if asset.error is not None:
+                raise asset.error
+            asset.model.upload()
+            self._ready(asset)
+            asset.wait_time = _timer() - start
+        return asset.model
+
+    def ready(self):
+        """Whether every registered model is ready"""
+        return not self._pending
+
+    def mark(self, event):
+        """Notes that event just happened, for report()"""
+        self._marks.append((event, _timer()))
+
+    def report(self):
+        """Returns lines of text saying when each mark() happened, and how
+        long each model took to build and upload and was waited for, in ms"""
+        start = self._marks[0][1]
+        lines = ["%-18s %8.1f" % (event, (when - start) * 1000) for event, when
+                in self._marks[1:]]
+        lines.append("%-18s %8s %8s %6s %8s" % ("model", "build", "upload",
+            "slices", "waited"))
+        for asset in self._order:
+            name = asset.name
+            if isinstance(name, tuple):
+                name = " ".join(map(str, name))
+            lines.append("%-18s %8.1f %8.1f %6d %8.1f" % (name,
+                asset.build_time * 1000, asset.upload_time * 1000,
+                asset.slices, asset.wait_time * 1000))
+        return lines
+
+manager = Assets()
+
+register = manager.register
+start = manager.start
+upload = manager.upload
+get = manager.get
+ready = manager.ready
+mark = manager.mark
+report = manager.report
@@ -1,10 +1,31 @@
 from __future__ import division
 
-from OpenGL.GLUT import *
+import os
+import sys
+
+# --capture draws through an EGL context instead of a GLUT window, so it
+# works with no display. PyOpenGL picks its platform once, when it's first
+# imported, so that has to be decided before anything imports it. See
+# capture.py
+if __name__ == "__main__" and any(arg == "--capture" or
+        arg.startswith("--capture=") for arg in sys.argv[1:]):
+    os.environ.setdefault("PYOPENGL_PLATFORM", "egl")
+    # Tells Mesa's EGL not to look for a display
+    os.environ.setdefault("EGL_PLATFORM", "surfaceless")
+
+try:
+    from OpenGL.GLUT import *
+except NotImplementedError:
+    # GLUT can't be used on the EGL platform, where PyOpenGL can't look up
+    # its fonts. Capturing is all that runs there, and needs none of it
+    pass
 from OpenGL.GL import *
 from OpenGL.GLU import *
 
+import atexit
+import argparse
 import math
+import random
 import numpy
 
 # Define these constants above the imports, some modules use them
@@ -14,13 +35,22 @@ fov = 45
 
 distance = HEIGHT/2 / math.tan(fov/2*math.pi/180)
 
+import assets
 import model
-import entity
 import ship
 import particle
 import levels
 import hud
 import enemy
+import util
+import collision
+import field
+import bullets
+import renderqueue
+import clock
+import fastgl
+import profiler
+import snapshot
 
 # Constants to draw axis lines
 c = [
@@ -44,14 +74,52 @@ def draw_string(x, y, z, txt):
 
 
 
+# How often the profiler overlay is refreshed, in frames
+OVERLAY_INTERVAL = 30
+
+# Frames between each of a level's aliens entering
+ALIEN_INTERVAL = 500
+
 class Game(object):
-    def __init__(self):
+    def __init__(self, profile=None, seed=None, levellist=None):
+        """profile is a profiler.Profiler to time each frame with, or None
+        to not profile.
+
+        levellist is the list of levels.Level to play through, starting from
+        index 1. If None, it's levels.level.
+
+        Everything random in the game is drawn from streams seeded with seed,
+        so the same seed and the same input always play out the same game.
+        If None, a seed is picked at random. Either way it's kept in
+        self.seed.
 
-        # list of all asteroids
-        self.asteroids = set()
+        """
+        if seed is None:
+            seed = random.randrange(2**32)
+        self.seed = seed
+        if levellist is None:
+            levellist = levels.level
+        self.levels = levellist
+        # Everything that affects play draws from this
+        self.rng = numpy.random.RandomState(seed)
+        # Particles draw from a stream of their own, and none are left over
+        # from a previous game
+        particle.seed([seed, 1])
+        particle.clear()
+
+        # All asteroids on the field. Build every asteroid shape up front, so
+        # asteroids appearing mid-game cost no GL work. The asset threads
+        # have been building them, and the other models, since they started
+        if not util.headless:
+            assets.start()
+            model.asteroid_variants.prebuild()
+        self.asteroids = field.AsteroidField(self.rng)
 
         # Setup the HUD
-        self.hud = hud.HUD()
+        if util.headless:
+            self.hud = hud.NullHUD()
+        else:
+            self.hud = hud.HUD()
 
         # Player
         self.ship = ship.Ship(hud=self.hud)
@@ -59,20 +127,56 @@ class Game(object):
         self.level = 1
         self.hud.set_level(self.level)
         self._level_frame = 0
+        self._aliens_entered = 0
+
+        # Enemies, in the order they entered
+        self.enemies = []
+
+        # How many ticks have been stepped
+        self.ticks = 0
 
-        # Set of enemies
-        self.enemies = set()
+        # A replay.Recorder, if this game is being recorded
+        self.recorder = None
+
+        # A capture.Capture to hand each frame to instead of the window, if
+        # the game is drawn offscreen
+        self.capture = None
+
+        # No bullets left over from a previous game
+        bullets.pool.clear()
 
         # Set up first level
-        self.asteroids.update(
-                levels.level[self.level].create_asteroids()
-                )
+        self.levels[self.level].create_asteroids(self.asteroids)
+
+        # Keeps the simulation running at a steady rate, however fast frames
+        # are drawn
+        self.clock = clock.Clock()
+
+        if profile is None:
+            profile = profiler.NullProfiler()
+        self.profiler = profile
+        # Whether the profiler's report is shown on screen
+        self.show_profile = not isinstance(profile, profiler.NullProfiler)
         
         # Start the game
         self._update_func = self._update_during_level
         self.ship.fly_in()
 
+        # Whether a frame has been drawn yet, and whether the asset timings
+        # have been shown
+        self._drawn = False
+        self._reported = False
+        if not util.headless:
+            assets.mark("startup")
+
     def draw(self):
+        prof = self.profiler
+        prof.start()
+
+        # Send a slice of whatever models have been built in the background
+        assets.upload()
+        prof.lap("draw_assets")
+
         glMatrixMode(GL_MODELVIEW)
         glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
 
@@ -99,66 +203,153 @@ class Game(object):
             draw_string( v[ 1 ][ 0 ], v[ 1 ][ 1 ], v[ 1 ][ 2 ], txt[ 1 ] )
             draw_string( v[ 2 ][ 0 ], v[ 2 ][ 1 ], v[ 2 ][ 2 ], txt[ 2 ] )
 
+        if self.show_profile and prof.frame % OVERLAY_INTERVAL == 0:
+            self.hud.set_overlay(prof.report())
         self.hud.draw()
+        prof.lap("draw_hud")
 
         glEnable(GL_LIGHTING)
 
-        # Draw things
-        for a in self.asteroids:
-            a.draw()
+        # Draw things in between the last two ticks, according to how much
+        # time has passed since the last one
+        alpha = self.clock.alpha
+
+        self.asteroids.draw(alpha)
+        prof.lap("draw_asteroids")
 
-        self.ship.draw()
+        self.ship.draw(alpha)
+        prof.lap("draw_ship")
 
-        particle.draw()
+        particle.draw(alpha)
+        prof.lap("draw_particles")
+
+        bullets.draw(alpha)
+        prof.lap("draw_bullets")
 
         for enemy in self.enemies:
-            enemy.draw()
+            enemy.draw(alpha)
+        prof.lap("draw_enemies")
+
+        # Everything above only queued its drawing. Do it all now
+        renderqueue.flush()
+        prof.lap("draw_render")
 
-        # flush the command pipeline and swap the buffers to display this frame
+        prof.end_frame(self)
+
+        # flush the command pipeline and swap the buffers to display this
+        # frame, or pass it on to be captured
         glFlush()
-        glutSwapBuffers()
+        if self.capture is not None:
+            self.capture.end_frame()
+        else:
+            glutSwapBuffers()
+
+        if not self._drawn:
+            self._drawn = True
+            assets.mark("first frame")
+        # When profiling, say how long loading took once it's all done
+        if self.show_profile and not self._reported and assets.ready():
+            self._reported = True
+            sys.stderr.write("\n".join(assets.report()) + "\n")
+
+    def update(self):
+        """Idle function. Runs as many ticks as have come due since the last
+        call, then redraws"""
+        ticks = self.clock.advance()
+        for i in xrange(ticks):
+            if i == ticks - 1:
+                # Only the state just before the last tick is drawn from
+                self.remember()
+            self.step()
+
+        # Cause a re-display. A capture is drawn by whoever's driving it
+        if self.capture is None:
+            glutPostRedisplay()
+
+    def remember(self):
+        """Saves where everything is, so the next frames can be drawn part way
+        between there and the following tick"""
+        self.asteroids.remember()
+        self.ship.remember()
+        for enemy in self.enemies:
+            enemy.remember()
+        bullets.remember()
+        particle.remember()
 
-    def update(self, value):
-        """Periodic update function"""
-        # Set a callback for 20ms
-        glutTimerFunc(20, self.update, 0)
+    def step(self):
+        """Advances the simulation by a single frame. This doesn't touch
+        OpenGL or GLUT, so it's also what headless.py calls in a tight loop
+        """
+        prof = self.profiler
+        prof.start()
 
-        # Change things here
-        for a in self.asteroids:
-            a.update()
+        self.asteroids.update()
+        prof.lap("update_asteroids")
 
         for enemy in self.enemies:
             enemy.update()
+        prof.lap("update_enemies")
 
         self.ship.update()
+        prof.lap("update_ship")
+
+        bullets.update()
+        prof.lap("update_bullets")
 
         self.collision()
+        prof.lap("update_collision")
 
         particle.update()
+        prof.lap("update_particles")
 
         self.game_update()
+        prof.lap("update_game_update")
+        prof.tick()
 
         self._level_frame += 1
-        if self._level_frame % 500 == 0:
-            newalien = levels.level[self.level].enter_alien(self.ship)
+        if self._level_frame % ALIEN_INTERVAL == 0:
+            newalien = self.levels[self.level].enter_alien(self.ship,
+                    self._aliens_entered)
             if newalien:
-                self.enemies.add(newalien)
-
-        # Cause a re-display
-        glutPostRedisplay()
+                self._aliens_entered += 1
+                self.enemies.append(newalien)
+
+        self.ticks += 1
+        if self.recorder is not None:
+            self.recorder.tick(self)
+
+    def counts(self):
+        """How many asteroids, enemies, bullets and particles there are, and
+        how many records the last frame drew, materials it sent and models it
+        bound"""
+        stats = renderqueue.stats()
+        return (len(self.asteroids), len(self.enemies),
+                len(bullets.pool.live()), particle.count(), stats['records'],
+                stats['materials'], stats['binds'])
+
+    def toggle_profile(self):
+        """Shows or hides the profiler overlay"""
+        self.show_profile = not self.show_profile
+        if not self.show_profile:
+            self.hud.set_overlay([])
 
     def keypress(self, key, x, y):
         """An ascii key was pressed"""
+        if self.recorder is not None:
+            self.recorder.key(self, key, True)
         try:
             {       GLUT_KEY_UP: lambda: self.ship.thrust(1),
                     GLUT_KEY_LEFT: lambda: self.ship.turn(1),
                     GLUT_KEY_RIGHT: lambda: self.ship.turn(-1),
                     ' ': lambda: self.ship.trigger(1),
+                    'p': self.toggle_profile,
             }[key]()
         except KeyError:
             pass
 
     def keyup(self, key, x, y):
+        if self.recorder is not None:
+            self.recorder.key(self, key, False)
         try:
             {       GLUT_KEY_UP: lambda: self.ship.thrust(0),
                     GLUT_KEY_LEFT: lambda: self.ship.turn(0),
@@ -168,6 +359,57 @@ class Game(object):
         except KeyError:
             pass
 
+    # The level states, for saving _update_func in snapshots
+    _UPDATE_FUNCS = ("_update_during_level", "_update_ship_next_level",
+            "_update_respawn")
+
+    # ticks, level, the level's frame count and aliens entered, then the
+    # index of _update_func and the count it keeps in _t
+    _STATE_FORMAT = "IiiiBi"
+
+    def snapshot(self):
+        """Returns the state of the game in progress as a compact string of
+        bytes, for restore(). See snapshot.py"""
+        w = snapshot.Writer()
+        w.values(self._STATE_FORMAT, self.ticks, self.level,
+                self._level_frame, self._aliens_entered,
+                self._UPDATE_FUNCS.index(self._update_func.__name__),
+                getattr(self, '_t', 0))
+        w.rng(self.rng)
+        particle.save_state(w)
+        self.ship.save_state(w)
+        self.asteroids.save_state(w)
+        w.values("I", len(self.enemies))
+        for alien in self.enemies:
+            w.values("B", enemy.TYPES.index(type(alien)))
+            alien.save_state(w)
+        bullets.pool.save_state(w)
+        return w.getvalue()
+
+    def restore(self, data):
+        """Puts the game back in the state a snapshot() was taken in"""
+        r = snapshot.Reader(data)
+        (self.ticks, self.level, self._level_frame, self._aliens_entered,
+                update_func, self._t) = r.values(self._STATE_FORMAT)
+        self._update_func = getattr(self, self._UPDATE_FUNCS[update_func])
+        r.rng(self.rng)
+        particle.load_state(r)
+        self.ship.load_state(r)
+        self.asteroids.load_state(r)
+
+        count, = r.values("I")
+        self.enemies = []
+        for _ in xrange(count):
+            kind, = r.values("B")
+            alien = enemy.TYPES[kind](self.ship)
+            alien.load_state(r)
+            self.enemies.append(alien)
+
+        # After the aliens, whose creation takes new bullet owner ids
+        bullets.pool.load_state(r)
+
+        self.hud.set_level(self.level)
+
     def collision(self):
         """Collision detection routine. Checks:
         1) collisions between the ship and each asteroid
@@ -175,62 +417,86 @@ class Game(object):
         3) The enemy's bullets and the ship
 
         """
-        # List of asteroid objects to add or remove at the end of this frame
-        # (so as not to mutate the asteroid set while we're iterating over it)
-        toremove = set()
-        toadd = set()
+        # Indices of asteroids to split and enemies to remove at the end of
+        # this frame (so as not to mutate them while we're iterating)
+        tosplit = set()
         enemies_toremove = set()
 
         ship = self.ship
-        for bullet in ship.bullets.bullets:
-            # Check the ship's bullet against each asteroid
-            for asteroid in self.asteroids:
-                if entity.check_collide(bullet, asteroid):
-                    # Collide the bullet with the asteroid
-                    bullet.ttl = 0
-                    newasteroids = asteroid.split()
-                    toadd.update(newasteroids)
-                    toremove.add(asteroid)
-
-            # Check the player's bullets against alien ships
-            for enemy in self.enemies:
-                if entity.check_collide(bullet, enemy):
-                    bullet.ttl = 0
-                    # Damage the alien ship
-                    if enemy.damage(ship.bullets.damage):
-                        # enemy was destroyed
-                        enemies_toremove.add(enemy)
+
+        # Gather each group into position and radius arrays, so every pair of
+        # groups is tested in one batch. The entity lists map the resulting
+        # indices back to objects. The asteroid field already keeps its
+        # positions and radii in arrays
+        asteroid_pos = self.asteroids.pos
+        asteroid_rad = self.asteroids.radius
+        enemies = self.enemies
+        enemy_pos, enemy_rad = collision.arrays(enemies)
+
+        # All bullets are in the shared pool. The player's are the ones
+        # fired by the ship's weapon, the rest are the aliens'
+        pool = bullets.pool
+        inflight = pool.live()
+        players = pool.owner[inflight] == ship.bullets.owner
+        player_bullets = inflight[players]
+        alien_bullets = inflight[~players]
+        bullet_pos = pool.pos[player_bullets]
+        bullet_rad = numpy.repeat(float(bullets.BULLET_RADIUS),
+                len(player_bullets))
+
+        # Check the ship's bullets against each asteroid
+        ib, ia = collision.hits(bullet_pos, bullet_rad,
+                asteroid_pos, asteroid_rad)
+        # Collide the bullets with the asteroids
+        pool.expire(player_bullets[ib])
+        tosplit.update(ia)
+
+        # Check the player's bullets against alien ships
+        for ib, ie in zip(*collision.hits(bullet_pos, bullet_rad,
+                enemy_pos, enemy_rad)):
+            enemy = enemies[ie]
+            pool.expire(player_bullets[ib])
+            # Damage the alien ship
+            if enemy.damage(pool.damage[player_bullets[ib]]):
+                # enemy was destroyed
+                enemies_toremove.add(enemy)
 
         if ship.is_active():
+            ship_pos, ship_rad = collision.arrays((ship,))
+
             # Check the ship against each asteroid
-            for asteroid in self.asteroids:
-                distance = numpy.linalg.norm(ship.pos - asteroid.pos)
-                if distance < ship.radius + asteroid.radius:
-                    # Collide the ship
-                    newasteroids = asteroid.split()
-                    toadd.update(newasteroids)
-                    toremove.add(asteroid)
-                    # hitting an asteroid does 1 damage
-                    ship.damage(1)
-                    if not ship.is_active():
-                        break # skip all other collision checks
+            for _, ia in zip(*collision.hits(ship_pos, ship_rad,
+                    asteroid_pos, asteroid_rad)):
+                # Collide the ship
+                tosplit.add(ia)
+                # hitting an asteroid does 1 damage
+                ship.damage(1)
+                if not ship.is_active():
+                    break # skip all other collision checks
 
             # Check alien bullets against the player ship
-            for enemy in self.enemies:
-                for bullet in enemy.bullets.bullets:
-                    # Collide this bullet with the player
-                    if entity.check_collide(bullet, self.ship):
-                        # Destroy the bullet
-                        bullet.ttl = 0
-                        # Damage the ship
-                        ship.damage(enemy.bullets.damage)
+            alien_bullet_pos = pool.pos[alien_bullets]
+            alien_bullet_rad = numpy.repeat(float(bullets.BULLET_RADIUS),
+                    len(alien_bullets))
+            for ib, _ in zip(*collision.hits(alien_bullet_pos,
+                    alien_bullet_rad, ship_pos, ship_rad)):
+                # Collide this bullet with the player
+                bullet = alien_bullets[ib]
+                # Destroy the bullet
+                pool.expire(bullet)
+                # Damage the ship
+                ship.damage(pool.damage[bullet])
 
             # Check player ship for collisions with alien ships
             # TODO
 
-        self.asteroids -= toremove
-        self.asteroids |= toadd
-        self.enemies -= enemies_toremove
+        self.asteroids.split(sorted(tosplit))
+        if enemies_toremove:
+            self.enemies = [enemy for enemy in self.enemies
+                    if enemy not in enemies_toremove]
+        # A destroyed alien's bullets go with it
+        for enemy in enemies_toremove:
+            enemy.bullets.release()
 
     def game_update(self):
         """Do various game administration here, such as level progression"""
@@ -277,8 +543,9 @@ class Game(object):
             # Init next level and fly-in
             self.level += 1
             self._level_frame = 0
+            self._aliens_entered = 0
             self.hud.set_level(self.level)
-            self.asteroids.update( levels.level[self.level].create_asteroids() )
+            self.levels[self.level].create_asteroids(self.asteroids)
             if self.ship.is_dead():
                 self.ship.new_ship()
             self.ship.fly_in()
@@ -294,22 +561,70 @@ class Game(object):
 
 
 def main():
-    # Init window
-    glutInit()
-    glutInitDisplayMode(GLUT_DOUBLE | GLUT_RGB | GLUT_DEPTH)
-    glutInitWindowSize(WIDTH, HEIGHT)
-    glutCreateWindow("Asteroids")
-
-    g = Game()
+    parser = argparse.ArgumentParser(description="Play asteroids")
+    parser.add_argument("--profile", nargs="?", const="", metavar="CSV",
+            help="time each frame and show the results on screen, toggled "
+            "with the p key. If a file is given, a row per frame is also "
+            "written to it")
+    parser.add_argument("--seed", type=int,
+            help="seed to start the game from")
+    parser.add_argument("--record", metavar="FILE",
+            help="record the game to a replay file. See replay.py")
+    parser.add_argument("--capture", metavar="OUTPUT",
+            help="draw offscreen through EGL, with no window or display, and "
+            "write every frame to a file, or pipe them to a command given as "
+            "\"|command\". See capture.py")
+    parser.add_argument("--frames", type=int,
+            help="with --capture, stop after this many frames")
+    parser.add_argument("--gl-debug", action="store_true",
+            help="make every GL call through PyOpenGL's checked wrappers. "
+            "See fastgl.py")
+    args = parser.parse_args()
+
+    if args.gl_debug:
+        fastgl.set_debug(True)
+
+    profile = None
+    if args.profile is not None:
+        profile = profiler.Profiler(args.profile or None)
+
+    # Start building the models while the window opens
+    assets.start()
+
+    context = None
+    if args.capture:
+        import capture
+    if args.capture and capture.egl_available():
+        # No window at all, just a context for the capture to draw with
+        context = capture.EGLContext()
+    else:
+        # Init window
+        glutInit()
+        glutInitDisplayMode(GLUT_DOUBLE | GLUT_RGB | GLUT_DEPTH)
+        glutInitWindowSize(WIDTH, HEIGHT)
+        glutCreateWindow("Asteroids")
+        if args.capture:
+            # The window only holds the GL context, nobody sees it
+            glutHideWindow()
+    assets.mark("window")
+
+    g = Game(profile, args.seed)
+
+    if args.record:
+        import replay
+        recorder = replay.Recorder(args.record, g)
+        # glutMainLoop never returns, the recording is finished on exit
+        atexit.register(recorder.close)
 
     # Setup callbacks
-    glutDisplayFunc(g.draw)
-    glutTimerFunc(0, g.update, 0)
-    glutKeyboardFunc(g.keypress)
-    glutKeyboardUpFunc(g.keyup)
-    glutSpecialFunc(g.keypress)
-    glutSpecialUpFunc(g.keyup)
-    # TODO: glutReshapeFunc
+    if not args.capture:
+        glutDisplayFunc(g.draw)
+        glutIdleFunc(g.update)
+        glutKeyboardFunc(g.keypress)
+        glutKeyboardUpFunc(g.keyup)
+        glutSpecialFunc(g.keypress)
+        glutSpecialUpFunc(g.keyup)
+        # TODO: glutReshapeFunc
 
     # Set up a perspective projection
     glMatrixMode(GL_PROJECTION)
@@ -356,6 +671,21 @@ def main():
     # For proper lighting calculation on scaled objects
     glEnable(GL_RESCALE_NORMAL)
 
+    if args.capture:
+        g.capture = capture.Capture(args.capture)
+        # One tick per frame, so the footage plays at full speed at 1/TICK
+        # frames per second however long each frame takes
+        g.clock = clock.Clock(tick=1, timer=lambda: g.capture.frames)
+        try:
+            while g.capture.frames != args.frames:
+                g.update()
+                g.draw()
+        finally:
+            g.capture.close()
+            if context is not None:
+                context.close()
+        return
+
     glutMainLoop()
 
 if __name__ == "__main__":
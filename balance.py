@@ -0,0 +1,290 @@
+from __future__ import division, print_function
+"""
+Measures how hard levels are, by having a pilot play them many times.
+
+A grid of levels.Level parameters is played headless, each level by the same
+number of games with the same seeds, so levels are compared over the same
+sequence of games. Each game is flown by a pilot, either one that turns
+towards the nearest target and shoots, or one that mashes keys at random. A
+game ends when the level is cleared, when the ship runs out of lives, or
+after a number of ticks.
+
+Games are spread over a pool of processes, one per core by default. Each game
+is independent, so the run takes about as many times less as there are
+processes. Workers write each game's METRICS into a row of one results
+table in shared memory, so results never pass between processes through
+pickling. The table is summarized per level once every game is done.
+
+Usage: python balance.py [-g games] [-j processes] [-p pilot] [-t ticks]
+                         [-o results.json] [--speeds N ...]
+                         [--asteroids N,N,... ...] [--aliens N,N,... ...]
+
+With none of --speeds, --asteroids and --aliens the shipped levels are
+played. With any of them, every combination is, with what's left out taken
+from level 1.
+
+"""
+import argparse
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import timeit
+
+import numpy
+
+import util
+import levels
+import ship
+
+GAMES = 100
+
+# A game still going after this many ticks ends anyway
+MAX_TICKS = 6000
+
+# What's recorded about each game, in the columns of the results table
+METRICS = ("ticks", "shots", "damage", "completed")
+
+_timer = timeit.default_timer
+
+class RandomPilot(object):
+    """Holds each control in a random position for a random while"""
+    # The chance of each control changing on a tick
+    CHANGE = 0.05
+
+    def __init__(self, seed):
+        self.rng = numpy.random.RandomState(seed)
+        self.controls = [0, 0, 0]
+
+    def controls_for(self, game):
+        rng = self.rng
+        thrust, turn, trigger = self.controls
+        if rng.random_sample() < self.CHANGE:
+            thrust = rng.randint(0, 2)
+        if rng.random_sample() < self.CHANGE:
+            turn = rng.randint(-1, 2)
+        if rng.random_sample() < self.CHANGE:
+            trigger = rng.randint(0, 2)
+        self.controls = [thrust, turn, trigger]
+        return thrust, turn, trigger
+
+class ScriptedPilot(object):
+    """Turns towards where the nearest asteroid or alien will be by the time
+    a bullet gets there, and shoots once lined up. Closes in on targets out
+    of range"""
+    # Farther than this from its target it thrusts, when lined up. Bullets
+    # only go about 250 before they expire
+    FAR = 200
+    # ...up to this speed
+    MAXSPEED = 2
+
+    def __init__(self, seed):
+        self._trigger = 0
+
+    def controls_for(self, game):
+        s = game.ship
+        pos = [game.asteroids.pos[:, :2]]
+        vel = [game.asteroids.vel[:, :2]]
+        radius = [game.asteroids.radius]
+        for alien in game.enemies:
+            pos.append([alien.pos[:2]])
+            vel.append([alien.vel[:2]])
+            radius.append([alien.radius])
+        pos = numpy.concatenate(pos)
+        if not len(pos):
+            self._trigger = 0
+            return 0, 0, 0
+        vel = numpy.concatenate(vel)
+        radius = numpy.concatenate(radius)
+
+        offset = pos - s.pos[:2]
+        dist = numpy.hypot(offset[:, 0], offset[:, 1])
+        i = dist.argmin()
+        # Lead the target. Bullets carry the ship's speed along with them
+        flight = dist[i] / s.bullets.speed
+        dx, dy = offset[i] + (vel[i] - s.speed[:2]) * flight
+        # The theta Ship.direction() would point along this offset
+        want = math.degrees(math.atan2(-dx, dy))
+        error = (want - s.theta + 180) % 360 - 180
+        # How far off a shot can be and still hit
+        aim = math.degrees(math.atan2(radius[i], math.hypot(dx, dy)))
+
+        turn = 0
+        if abs(error) > ship.SHIP_ROTSPEED / 2:
+            turn = 1 if error > 0 else -1
+        # The trigger fires when pressed, so let go between shots
+        self._trigger = int(abs(error) < aim and not self._trigger)
+        thrust = int(dist[i] > self.FAR and abs(error) < 30 and
+                numpy.linalg.norm(s.speed) < self.MAXSPEED)
+        return thrust, turn, self._trigger
+
+PILOTS = dict(random=RandomPilot, scripted=ScriptedPilot)
+
+def play(level, seed, pilot, max_ticks=MAX_TICKS):
+    """Plays level with a new headless Game from seed, flown by a pilot of
+    the given class. Returns the game's METRICS"""
+    util.headless = True
+    import asteroids
+
+    game = asteroids.Game(seed=seed, levellist=[None, level])
+    s = game.ship
+    pilot = pilot(seed)
+
+    damage = 0
+    completed = False
+    while game.ticks < max_ticks:
+        thrust, turn, trigger = pilot.controls_for(game)
+        s.thrust(thrust)
+        s.turn(turn)
+        s.trigger(trigger)
+
+        shields = s.shields
+        lives = s.lives
+        game.step()
+        # A hit either takes shields or, with none left, a life
+        damage += max(0, shields - s.shields) + (lives - s.lives)
+
+        if not len(game.asteroids) and not game.enemies:
+            completed = True
+            break
+        if s.lives <= 0:
+            break
+
+    return game.ticks, s.bullets.fired, damage, completed
+
+# Set in each worker process by _init_worker
+_worker = None
+
+def _init_worker(table, rows, grid, pilot, max_ticks):
+    global _worker
+    _worker = (numpy.frombuffer(table).reshape(rows, len(METRICS)), grid,
+            PILOTS[pilot], max_ticks)
+
+def _play_row(job):
+    """Plays one game and writes its metrics into the shared table"""
+    row, level, seed = job
+    results, grid, pilot, max_ticks = _worker
+    results[row] = play(grid[level], seed, pilot, max_ticks)
+
+def run(grid, games=GAMES, processes=None, pilot="scripted",
+        max_ticks=MAX_TICKS, seed=0):
+    """Plays games of each Level in grid. Returns an array of METRICS, one
+    row per game: the games of grid[0] with seeds seed, seed+1, ... then
+    those of grid[1] and so on"""
+    rows = len(grid) * games
+    table = multiprocessing.RawArray('d', rows * len(METRICS))
+    jobs = [(row, row // games, seed + row % games) for row in xrange(rows)]
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(processes, _init_worker,
+            (table, rows, grid, pilot, max_ticks))
+    try:
+        # Small batches, so a slow level doesn't leave workers idle at the
+        # end
+        chunk = max(1, rows // (processes * 16))
+        for _ in pool.imap_unordered(_play_row, jobs, chunk):
+            pass
+    finally:
+        pool.terminate()
+        pool.join()
+
+    return numpy.frombuffer(table).reshape(rows, len(METRICS)).copy()
+
+def describe(level):
+    return "speed %s asteroids %s aliens %s" % (level.speed,
+            ",".join(map(str, level.asteroids)) or "-",
+            ",".join(map(str, level.aliens)) or "-")
+
+def summarize(grid, results, games):
+    """Returns a dict of statistics for each level in grid, in order"""
+    summary = []
+    for i, level in enumerate(grid):
+        rows = results[i*games:(i+1)*games]
+        ticks, shots, damage, completed = rows.T
+        done = completed.astype(bool)
+        summary.append(dict(
+                level=describe(level),
+                games=games,
+                completion=done.mean(),
+                # Only the games that cleared the level say how long it takes
+                clear_ticks=(numpy.median(ticks[done]) if done.any()
+                    else None),
+                ticks=numpy.median(ticks),
+                shots=shots.mean(),
+                damage=damage.mean(),
+                damage_per_1000_ticks=1000 * damage.sum() / ticks.sum(),
+                ))
+    return summary
+
+def grid_from(speeds, asteroids, aliens):
+    """Every combination of the given parameters, as Levels. Any left as None
+    are taken from level 1"""
+    first = levels.level[1]
+    return [levels.Level(speed, list(a), list(e)) for speed, a, e in
+            itertools.product(speeds or [first.speed],
+                asteroids or [first.asteroids],
+                aliens if aliens is not None else [first.aliens])]
+
+def _numbers(text):
+    return [int(n) for n in text.split(",") if n]
+
+def main():
+    parser = argparse.ArgumentParser(
+            description="Measure how hard levels are to play")
+    parser.add_argument("-g", "--games", type=int, default=GAMES,
+            help="games per level")
+    parser.add_argument("-j", "--processes", type=int,
+            help="processes to play on, default one per core")
+    parser.add_argument("-p", "--pilot", choices=sorted(PILOTS),
+            default="scripted")
+    parser.add_argument("-t", "--ticks", type=int, default=MAX_TICKS,
+            help="longest a game may go on")
+    parser.add_argument("-s", "--seed", type=int, default=0,
+            help="seed of each level's first game")
+    parser.add_argument("-o", "--output",
+            help="file to write JSON results to")
+    parser.add_argument("--speeds", type=int, nargs="+")
+    parser.add_argument("--asteroids", type=_numbers, nargs="+",
+            help="how many asteroids of each size, e.g. 5,3,1")
+    parser.add_argument("--aliens", type=_numbers, nargs="+",
+            help="the aliens that enter, e.g. 1,1. An empty string for none")
+    args = parser.parse_args()
+
+    if args.speeds or args.asteroids or args.aliens is not None:
+        grid = grid_from(args.speeds, args.asteroids, args.aliens)
+    else:
+        grid = levels.level[1:]
+
+    # Models and their materials are found relative to the game's directory
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    start = _timer()
+    results = run(grid, args.games, args.processes, args.pilot, args.ticks,
+            args.seed)
+    elapsed = _timer() - start
+    summary = summarize(grid, results, args.games)
+
+    print("%d games in %.1fs, %.1f games/s" % (len(results), elapsed,
+        len(results) / elapsed))
+    print("%-40s %6s %8s %8s %7s %7s" % ("level", "clear", "ticks",
+        "to clear", "shots", "damage"))
+    for s in summary:
+        print("%-40s %5.1f%% %8d %8s %7.1f %7.2f" % (s['level'],
+            s['completion'] * 100, s['ticks'],
+            "-" if s['clear_ticks'] is None else "%d" % s['clear_ticks'],
+            s['shots'], s['damage']))
+
+    if args.output:
+        f = open(args.output, 'w')
+        try:
+            json.dump(dict(pilot=args.pilot, games=args.games,
+                max_ticks=args.ticks, seed=args.seed, levels=summary,
+                results=dict((m, results[:, i].tolist()) for i, m in
+                    enumerate(METRICS))), f, indent=2)
+        finally:
+            f.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,415 @@
+from __future__ import division
+"""
+Many games stepped at once, for training and tuning against.
+
+A BatchEnv plays n independent games of one level. Instead of a Game, Ship,
+AsteroidField and aliens for each, it keeps every game's state in stacked
+numpy arrays whose first axis is the game: the ship's position is
+ship_pos[game], asteroid slot i of a game is ast_pos[game, i], and so on.
+Asteroids, aliens and bullets live in fixed numbers of slots per game, enough
+for the most there can ever be at once, and a slot is free when its size,
+alive flag or ttl says so. One step() moves and collides all of the games in
+a handful of array operations, however many there are.
+
+The rules are the game's own, taken from the same constants: Ship.update,
+AsteroidField.split, Alien1.update and Game.collision each have a part of
+step() below that does what they do, in the same order Game.step() does it.
+Only what can't change the outcome is left out: particles, spinning, shield
+flashes and the HUD. Beyond that, a game here differs from a Game in that:
+
+  * The ship starts where the fly-in would leave it, under control from the
+    first tick
+  * Every alien is an Alien1, the only kind there is
+  * A game ends when the ship is destroyed or the level is cleared, and
+    starts over. There are no lives and no next level
+
+Each game gets an action per step of (thrust, turn, fire): thrust is 0 or 1,
+turn is -1, 0 or 1 as Ship.turn takes it, and fire is 0 or 1, which is like
+holding the trigger down with autofire on.
+
+"""
+import numpy
+
+import asteroids
+import bullets
+import enemy
+import field
+import ship
+
+from asteroids import WIDTH, HEIGHT
+
+# Rewards for each asteroid shot, each alien destroyed and each point of
+# shields lost, and for the ship being destroyed and for clearing the level
+REWARD_ASTEROID = 1
+REWARD_ALIEN = 5
+REWARD_DAMAGE = -1
+REWARD_DESTROYED = -10
+REWARD_CLEARED = 10
+
+# A game that has lasted this many ticks ends anyway
+MAX_TICKS = 5000
+
+# Where the ship starts, and the way it's facing, as the fly-in leaves it
+SHIP_START = (WIDTH/2, HEIGHT/2)
+SHIP_THETA = 90
+
+def _direction(theta):
+    """The unit vectors the ship points along at angles theta, with phi 0.
+    Same as Ship.direction"""
+    theta = numpy.radians(theta)
+    return numpy.stack((-numpy.sin(theta), numpy.cos(theta)), axis=-1)
+
+def _wrap(pos, wrapdist):
+    """Wraps positions that have drifted more than wrapdist past the edges of
+    the field to the other side, in place. wrapdist is a number or an array
+    of one for each position"""
+    for axis, limit in ((0, WIDTH), (1, HEIGHT)):
+        coord = pos[..., axis]
+        coord[...] = numpy.where(coord > limit + wrapdist, -wrapdist,
+                numpy.where(coord < -wrapdist, limit + wrapdist, coord))
+
+def _touching(pos_a, rad_a, pos_b, rad_b):
+    """For each game, which of group a touch which of group b. pos_a is
+    (n, a, 2) and pos_b is (n, b, 2), and the result is (n, a, b)"""
+    diff = pos_a[:, :, numpy.newaxis, :] - pos_b[:, numpy.newaxis, :, :]
+    dist2 = numpy.einsum('nabk,nabk->nab', diff, diff)
+    reach = rad_a + rad_b
+    return dist2 < reach * reach
+
+def _damage(shields, hits, amount):
+    """Applies hits of amount damage each to shields, one after another the
+    way Ship.damage does. Returns the shields left, whether the ship was
+    destroyed, and which hit destroyed it (counting from 1)"""
+    # A hit with no shields left destroys the ship
+    lethal = numpy.ceil(shields / amount) + 1
+    destroyed = hits >= lethal
+    shields = numpy.where(destroyed, 0,
+            numpy.maximum(0, shields - hits * amount))
+    return shields, destroyed, lethal
+
+class BatchEnv(object):
+    def __init__(self, n, level=1, seed=None, max_ticks=MAX_TICKS):
+        """n is how many games to play at once. level is a levels.Level or
+        the number of one. All randomness comes from seed"""
+        import levels
+        if not isinstance(level, levels.Level):
+            level = levels.level[level]
+        self.n = n
+        self.level = level
+        self.max_ticks = max_ticks
+        self.rng = numpy.random.RandomState(seed)
+
+        # The sizes of the level's asteroids, in the slots they start in
+        self._start_size = numpy.repeat(
+                numpy.arange(1, len(level.asteroids) + 1), level.asteroids)
+        # An asteroid of size s ends up as at most 2**(s-1) pieces
+        asteroid_slots = max(1, int((2 ** (self._start_size - 1)).sum()))
+        alien_slots = max(1, len(level.aliens))
+        bullet_slots = bullets.Bullets.maxbullets
+
+        self.ship_pos = numpy.zeros((n, 2))
+        self.ship_vel = numpy.zeros((n, 2))
+        self.ship_theta = numpy.zeros((n,))
+        self.shields = numpy.zeros((n,))
+        self.cooldown = numpy.zeros((n,), dtype=int)
+
+        # A size of 0 is a free slot
+        self.ast_pos = numpy.zeros((n, asteroid_slots, 2))
+        self.ast_vel = numpy.zeros((n, asteroid_slots, 2))
+        self.ast_size = numpy.zeros((n, asteroid_slots), dtype=int)
+        self.ast_maxvel = numpy.zeros((n, asteroid_slots))
+        self.ast_radius = numpy.zeros((n, asteroid_slots))
+        self.ast_wrapdist = numpy.zeros((n, asteroid_slots))
+
+        # Alien slot i is the i-th alien to enter
+        self.alien_alive = numpy.zeros((n, alien_slots), dtype=bool)
+        self.alien_pos = numpy.zeros((n, alien_slots, 2))
+        self.alien_vel = numpy.zeros((n, alien_slots, 2))
+        self.alien_health = numpy.zeros((n, alien_slots))
+        self.alien_redirect = numpy.zeros((n, alien_slots), dtype=int)
+        self.alien_fire = numpy.zeros((n, alien_slots), dtype=int)
+        self.aliens_entered = numpy.zeros((n,), dtype=int)
+
+        # The ship's bullets, and each alien's. An alien fires less often
+        # than its bullets last, so it never has more than one in flight. A
+        # ttl of 0 or below is a free slot
+        self.bullet_pos = numpy.zeros((n, bullet_slots, 2))
+        self.bullet_vel = numpy.zeros((n, bullet_slots, 2))
+        self.bullet_ttl = numpy.zeros((n, bullet_slots), dtype=int)
+        self.alien_bullet_pos = numpy.zeros((n, alien_slots, 2))
+        self.alien_bullet_vel = numpy.zeros((n, alien_slots, 2))
+        self.alien_bullet_ttl = numpy.zeros((n, alien_slots), dtype=int)
+
+        # Ticks into each game
+        self.ticks = numpy.zeros((n,), dtype=int)
+
+        # How each game ended on the last step, if it did
+        self.cleared = numpy.zeros((n,), dtype=bool)
+        self.destroyed = numpy.zeros((n,), dtype=bool)
+
+        self.reset()
+
+    def reset(self, which=None):
+        """Starts the games picked by which, a boolean array or indices, over
+        from the beginning of the level. All of them if None. Returns the
+        observations, as step() does"""
+        if which is None:
+            which = numpy.arange(self.n)
+        which = numpy.asarray(which)
+        if which.dtype == bool:
+            which = numpy.flatnonzero(which)
+        count = len(which)
+        rng = self.rng
+
+        self.ship_pos[which] = SHIP_START
+        self.ship_vel[which] = 0
+        self.ship_theta[which] = SHIP_THETA
+        self.shields[which] = ship.SHIP_SHIELDS
+        self.cooldown[which] = 0
+
+        # The level's asteroids, placed and sent off as field.spawn does
+        start = len(self._start_size)
+        self.ast_size[which] = 0
+        self.ast_vel[which] = 0
+        if start:
+            pos = numpy.empty((count, start, 2))
+            pos[..., 0] = rng.uniform(0, WIDTH, size=(count, start))
+            pos[..., 1] = rng.uniform(0, HEIGHT, size=(count, start))
+            games = numpy.repeat(which, start)
+            slots = numpy.tile(numpy.arange(start), count)
+            self._place(games, slots, pos.reshape(-1, 2),
+                    numpy.tile(self._start_size, count),
+                    numpy.repeat(float(self.level.speed), count * start))
+
+        self.alien_alive[which] = False
+        self.aliens_entered[which] = 0
+        self.bullet_ttl[which] = 0
+        self.alien_bullet_ttl[which] = 0
+        self.ticks[which] = 0
+
+        return self.observe()
+
+    def _place(self, games, slots, pos, size, maxvel):
+        """Puts new asteroids in the given slots of the given games, with
+        random velocities up to maxvel in each direction"""
+        scale = field.asteroid_scale(size)
+        self.ast_pos[games, slots] = pos
+        self.ast_vel[games, slots] = (self.rng.uniform(-1, 1,
+            size=(len(games), 2)) * maxvel[:, numpy.newaxis])
+        self.ast_size[games, slots] = size
+        self.ast_maxvel[games, slots] = maxvel
+        self.ast_radius[games, slots] = field.RADIUS_SCALE * scale
+        self.ast_wrapdist[games, slots] = field.WRAPDIST_SCALE * scale
+
+    def observe(self):
+        """Returns the state of every game as a dict of arrays, each with the
+        game as its first axis:
+            ship: (n, 6) of x, y, x and y velocity, theta and shields
+            asteroids: (n, slots, 5) of x, y, x and y velocity and size, 0
+                for an empty slot
+            aliens: (n, slots, 5) of x, y, x and y velocity and health, 0
+                for an empty slot
+            bullets, alien_bullets: (n, slots, 5) of x, y, x and y velocity
+                and frames left to live, 0 or below for an empty slot
+        """
+        stack = numpy.concatenate
+        new = numpy.newaxis
+        health = numpy.where(self.alien_alive, self.alien_health, 0)
+        return dict(
+                ship=numpy.column_stack((self.ship_pos, self.ship_vel,
+                    self.ship_theta % 360, self.shields)),
+                asteroids=stack((self.ast_pos, self.ast_vel,
+                    self.ast_size[..., new]), axis=2),
+                aliens=stack((self.alien_pos, self.alien_vel,
+                    health[..., new]), axis=2),
+                bullets=stack((self.bullet_pos, self.bullet_vel,
+                    self.bullet_ttl[..., new]), axis=2),
+                alien_bullets=stack((self.alien_bullet_pos,
+                    self.alien_bullet_vel, self.alien_bullet_ttl[..., new]),
+                    axis=2),
+                )
+
+    def step(self, actions):
+        """Plays a tick of every game. actions is an (n, 3) array of thrust,
+        turn and fire for each game. Returns the observations, the reward
+        each game earned and which games ended. Games that ended have been
+        started over, and their observations are of the new game"""
+        actions = numpy.asarray(actions)
+        thrust = actions[:, 0] != 0
+        turn = numpy.sign(actions[:, 1])
+        fire = actions[:, 2] != 0
+
+        self._update_asteroids()
+        self._update_aliens()
+        self._update_ship(thrust, turn, fire)
+        self._update_bullets()
+        rewards = self._collision()
+
+        self.cleared = ((self.ast_size == 0).all(axis=1) &
+                ~self.alien_alive.any(axis=1))
+        rewards += REWARD_CLEARED * self.cleared
+        rewards += REWARD_DESTROYED * self.destroyed
+
+        self.ticks += 1
+        self._enter_aliens()
+
+        dones = self.cleared | self.destroyed | (self.ticks >= self.max_ticks)
+        if dones.any():
+            self.reset(dones)
+        return self.observe(), rewards, dones
+
+    def _update_asteroids(self):
+        """AsteroidField.update"""
+        self.ast_pos += self.ast_vel
+        _wrap(self.ast_pos, self.ast_wrapdist)
+
+    def _update_aliens(self):
+        """Alien1.update, for every alien in every game"""
+        alive = self.alien_alive
+        self.alien_pos[alive] += self.alien_vel[alive]
+        self.alien_redirect[alive] -= 1
+        self.alien_fire[alive] -= 1
+        self.alien_vel[alive] *= enemy.Alien1.drag
+
+        toward = self.ship_pos[:, numpy.newaxis, :] - self.alien_pos
+        norm = numpy.sqrt(numpy.einsum('nak,nak->na', toward, toward))
+        toward /= numpy.maximum(norm, 1e-9)[..., numpy.newaxis]
+
+        redirect = alive & (self.alien_redirect <= 0)
+        self.alien_redirect[redirect] = enemy.Alien1.redirect_interval
+        self.alien_vel[redirect] = toward[redirect] * enemy.Alien1.speed
+
+        shoot = alive & (self.alien_fire <= 0)
+        self.alien_fire[shoot] = enemy.Alien1.fire_interval
+        self.alien_bullet_pos[shoot] = self.alien_pos[shoot]
+        self.alien_bullet_vel[shoot] = toward[shoot] * bullets.Bullets.speed
+        self.alien_bullet_ttl[shoot] = bullets.Bullets.maxtime
+
+    def _update_ship(self, thrust, turn, fire):
+        """Ship.update for an active ship, with the trigger held down and
+        autofire on for the games in fire"""
+        self.ship_pos += self.ship_vel
+        _wrap(self.ship_pos, ship.Ship.WRAPDIST)
+
+        self.ship_vel[thrust] += (ship.SHIP_ACCEL *
+                _direction(self.ship_theta[thrust]))
+        self.ship_theta += ship.SHIP_ROTSPEED * turn
+
+        # Ship.fire, from the ship's center
+        Bullets = bullets.Bullets
+        inflight = self.bullet_ttl > 0
+        fire = (fire & (inflight.sum(axis=1) < Bullets.maxbullets) &
+                (self.cooldown <= 0))
+        games = numpy.flatnonzero(fire)
+        # The first free slot of each
+        slots = numpy.argmin(inflight[games], axis=1)
+        self.bullet_pos[games, slots] = self.ship_pos[games]
+        self.bullet_vel[games, slots] = (Bullets.speed *
+                _direction(self.ship_theta[games]) + self.ship_vel[games])
+        self.bullet_ttl[games, slots] = Bullets.maxtime
+        self.cooldown[fire] = Bullets.rate
+
+        # Bullets.update
+        self.cooldown[self.cooldown > 0] -= 1
+
+    def _update_bullets(self):
+        """ProjectilePool.update"""
+        for pos, vel, ttl in ((self.bullet_pos, self.bullet_vel,
+                self.bullet_ttl), (self.alien_bullet_pos,
+                self.alien_bullet_vel, self.alien_bullet_ttl)):
+            live = ttl > 0
+            pos[live] += vel[live]
+            ttl[live] -= 1
+            _wrap(pos, bullets.ProjectilePool.WRAPDIST)
+
+    def _collision(self):
+        """Game.collision, for every game. Returns the rewards earned"""
+        new = numpy.newaxis
+        radius = bullets.BULLET_RADIUS
+        damage = bullets.Bullets.damage
+        present = self.ast_size > 0
+        inflight = self.bullet_ttl > 0
+
+        # The ship's bullets against asteroids and aliens, all of them
+        # tested before any are taken out of flight
+        hit = (inflight[:, :, new] & present[:, new, :] &
+                _touching(self.bullet_pos, radius, self.ast_pos,
+                    self.ast_radius[:, new, :]))
+        tosplit = hit.any(axis=1)
+        expire = hit.any(axis=2)
+        rewards = REWARD_ASTEROID * tosplit.sum(axis=1).astype(float)
+
+        hit = (inflight[:, :, new] & self.alien_alive[:, new, :] &
+                _touching(self.bullet_pos, radius, self.alien_pos,
+                    enemy.Alien1.radius))
+        expire |= hit.any(axis=2)
+        self.alien_health -= damage * hit.sum(axis=1)
+        killed = self.alien_alive & hit.any(axis=1) & (self.alien_health <= 0)
+        rewards += REWARD_ALIEN * killed.sum(axis=1)
+        self.bullet_ttl[expire] = 0
+
+        # The ship against asteroids, in order, until it's destroyed. Each
+        # one it hits is split, up to the one that destroyed it
+        shields = self.shields
+        ship_pos = self.ship_pos[:, new, :]
+        hit = present & _touching(ship_pos, ship.SHIP_RADIUS, self.ast_pos,
+                self.ast_radius[:, new, :])[:, 0, :]
+        self.shields, self.destroyed, lethal = _damage(shields,
+                hit.sum(axis=1), 1)
+        tosplit |= hit & (numpy.cumsum(hit, axis=1) <= lethal[:, new])
+
+        # Alien bullets against the ship. They're used up even if it's
+        # already been destroyed
+        hit = (self.alien_bullet_ttl > 0) & _touching(self.alien_bullet_pos,
+                radius, ship_pos, ship.SHIP_RADIUS)[:, :, 0]
+        self.alien_bullet_ttl[hit] = 0
+        self.shields, destroyed, _ = _damage(self.shields, hit.sum(axis=1),
+                damage)
+        self.destroyed |= destroyed
+        rewards += REWARD_DAMAGE * (shields - self.shields)
+
+        self._split(tosplit)
+        # A destroyed alien's bullet goes with it
+        self.alien_alive[killed] = False
+        self.alien_bullet_ttl[killed] = 0
+        return rewards
+
+    def _split(self, tosplit):
+        """AsteroidField.split, for the asteroids in tosplit, a boolean array
+        of the same shape as the asteroid slots"""
+        size = self.ast_size
+        # Two fragments per parent, in order of game
+        games, slots = numpy.nonzero(tosplit & (size > 1))
+        games = numpy.repeat(games, 2)
+        slots = numpy.repeat(slots, 2)
+        count = len(games)
+        newpos = self.ast_pos[games, slots] + (self.rng.uniform(-1, 1,
+            size=(count, 2)) * self.ast_radius[games, slots, numpy.newaxis]
+            / 2)
+        newsize = size[games, slots] - 1
+        newmaxvel = self.ast_maxvel[games, slots] * field.SPLIT_SPEEDUP
+
+        size[tosplit] = 0
+        self.ast_vel[tosplit] = 0
+        if not count:
+            return
+
+        # Each game's free slots, first to last, and which of the game's
+        # fragments each one is
+        free = numpy.argsort(size > 0, axis=1, kind='mergesort')
+        nth = numpy.arange(count) - numpy.searchsorted(games, games)
+        self._place(games, free[games, nth], newpos, newsize, newmaxvel)
+
+    def _enter_aliens(self):
+        """The next of the level's aliens enters every ALIEN_INTERVAL ticks,
+        as in Game.step"""
+        games = numpy.flatnonzero((self.ticks % asteroids.ALIEN_INTERVAL == 0)
+                & (self.aliens_entered < len(self.level.aliens)))
+        slots = self.aliens_entered[games]
+        self.alien_alive[games, slots] = True
+        self.alien_pos[games, slots] = 0
+        self.alien_vel[games, slots] = 0
+        self.alien_health[games, slots] = enemy.Alien1.health
+        self.alien_redirect[games, slots] = enemy.Alien1.redirect_first
+        self.alien_fire[games, slots] = enemy.Alien1.fire_first
+        self.aliens_entered[games] += 1
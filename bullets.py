@@ -1,38 +1,195 @@
 from __future__ import division
 
-from OpenGL.GLUT import glutSolidSphere
 from OpenGL.GL import *
 
 import numpy
 
-import entity
 import model
+import instancing
+import renderqueue
 import util
 
 from asteroids import WIDTH, HEIGHT
 
+# How many bullets can be in flight at once, from everyone combined
+MAX_BULLETS = 1024
+
+# Collision radius of a single bullet
+BULLET_RADIUS = 1
+
+class ProjectilePool(object):
+    """Every bullet in flight, from the player and every alien.
+
+    Bullets are rows in a set of preallocated arrays: position, velocity,
+    frames left to live, who fired it, how much damage it does and its color.
+    A row whose ttl is 0 or below is free. The whole pool moves, wraps and
+    expires in one go each frame, however many bullets there are.
+
+    """
+    WRAPDIST = 25
+
+    def __init__(self, size=MAX_BULLETS):
+        self.size = size
+        self.pos = numpy.zeros((size, 3), dtype=float)
+        self.vel = numpy.zeros((size, 3), dtype=float)
+        self.ttl = numpy.zeros((size,), dtype=int)
+        self.owner = numpy.zeros((size,), dtype=int)
+        self.damage = numpy.zeros((size,), dtype=float)
+        self.color = numpy.zeros((size, 4), dtype=float)
+        # Positions as of the tick before, for drawing in between ticks
+        self.prev_pos = numpy.zeros((size, 3), dtype=float)
+
+        # Owner ids are handed out by new_owner(). 0 is never used
+        self._last_owner = 0
+
+        # Created when first drawn, since it needs a GL context
+        self._model = None
+
+    def new_owner(self):
+        """Returns a new owner id to tag bullets with"""
+        self._last_owner += 1
+        return self._last_owner
+
+    def add(self, owner, pos, vel, ttl, damage, color):
+        """Puts a new bullet in flight. Returns False if the pool is full"""
+        free = numpy.flatnonzero(self.ttl <= 0)
+        if not len(free):
+            return False
+        i = free[0]
+        self.pos[i] = pos
+        self.prev_pos[i] = pos
+        self.vel[i] = vel
+        self.ttl[i] = ttl
+        self.owner[i] = owner
+        self.damage[i] = damage
+        self.color[i] = color
+        return True
+
+    def live(self, owner=None):
+        """Returns the indices of the bullets in flight, either all of them or
+        just the given owner's"""
+        live = self.ttl > 0
+        if owner is not None:
+            live &= self.owner == owner
+        return numpy.flatnonzero(live)
+
+    def count(self, owner):
+        """How many of the given owner's bullets are in flight"""
+        return numpy.count_nonzero((self.ttl > 0) & (self.owner == owner))
+
+    def expire(self, indices):
+        """Takes the bullets at the given indices out of flight"""
+        self.ttl[indices] = 0
+
+    def release(self, owner):
+        """Takes all of an owner's bullets out of flight"""
+        self.ttl[self.owner == owner] = 0
+
+    def clear(self):
+        self.ttl[:] = 0
+
+    def update(self):
+        """Call this once a frame. Updates the position of all bullets and
+        removes any that have traveled their max distance
+        """
+        live = self.live()
+        if not len(live):
+            return
+        pos = self.pos[live] + self.vel[live]
+        self.ttl[live] -= 1
+
+        wrapdist = self.WRAPDIST
+        for axis, limit in ((0, WIDTH), (1, HEIGHT)):
+            coord = pos[:, axis]
+            coord[coord > limit + wrapdist] = -wrapdist
+            coord[coord < -wrapdist] = limit + wrapdist
+
+        self.pos[live] = pos
+
+    def save_state(self, w):
+        """Writes the bullets in flight to a snapshot.Writer. Free slots
+        aren't written"""
+        live = self.live()
+        w.values("i", self._last_owner)
+        w.array(live, "<i4")
+        w.array(numpy.column_stack((self.ttl[live], self.owner[live])),
+                "<i4")
+        w.array(numpy.column_stack((self.pos[live], self.vel[live],
+            self.damage[live], self.color[live])), "<f8")
+
+    def load_state(self, r):
+        """Reads back what save_state() wrote, from a snapshot.Reader"""
+        self._last_owner, = r.values("i")
+        live = r.array("<i4")
+        ints = r.array("<i4", (2,))
+        floats = r.array("<f8", (11,))
+        self.ttl[:] = 0
+        self.ttl[live] = ints[:, 0]
+        self.owner[live] = ints[:, 1]
+        self.pos[live] = floats[:, 0:3]
+        self.vel[live] = floats[:, 3:6]
+        self.damage[live] = floats[:, 6]
+        self.color[live] = floats[:, 7:11]
+        self.remember()
+
+    def remember(self):
+        """Saves the current positions, to draw from after the next update"""
+        self.prev_pos[:] = self.pos
+
+    def draw(self, alpha=1):
+        live = self.live()
+        if not len(live):
+            return
+        pos = util.interpolate(self.prev_pos[live], self.pos[live], alpha)
+        if self._model is None:
+            self._model = model.SphereModel(5, 5, 5)
+
+        # Bullets of a color are drawn together, with that color as their
+        # material
+        colors = self.color[live]
+        for color in numpy.unique(colors, axis=0):
+            which = pos[numpy.all(colors == color, axis=1)]
+
+            if instancing.available():
+                instances = numpy.zeros((len(which), 8), dtype=numpy.float32)
+                instances[:, :3] = which
+                instances[:, 3] = 1
+                # Any axis will do for no rotation
+                instances[:, 6] = 1
+                renderqueue.submit_call(instancing.draw_instances,
+                        self._model, instances, material=color)
+            else:
+                for p in which:
+                    renderqueue.submit(self._model,
+                            ((renderqueue.TRANSLATE, p),), color)
+
 class Bullets(object):
-    """A class to manage a set of bullets"""
-    def __init__(self, color=(0,1,0,1) ):
-        # A list of bullet entities
-        self.bullets = set()
-
-        # Various bullet firing parameters. This class doesn't enforce these,
-        # just keep track of them
-        self.maxbullets = 3
-        self.maxtime = 50
-        self.speed = 5
-        self.rate = 15 # in frames
-        self.damage = 1
+    """A class to manage one owner's bullets. The bullets themselves are kept
+    in the shared ProjectilePool"""
+
+    # Various bullet firing parameters. This class doesn't enforce these,
+    # just keep track of them
+    maxbullets = 3
+    maxtime = 50
+    speed = 5
+    rate = 15 # in frames
+    damage = 1
+
+    def __init__(self, color=(0,1,0,1)):
+        self.pool = pool
+        self.owner = pool.new_owner()
 
         self._cooldown = 0
 
+        # How many shots have been fired
+        self.fired = 0
+
         self.color = color
 
     def can_fire(self):
         """Returns true if, according to the constraints, should be allowed to
         fire its weapon"""
-        if len(self.bullets) >= self.maxbullets:
+        if self.pool.count(self.owner) >= self.maxbullets:
             return False
         if self._cooldown > 0:
             return False
@@ -41,77 +198,27 @@ class Bullets(object):
     def fire(self, pos, vel):
         """Fire a bullet"""
         self._cooldown = self.rate
+        self.fired += 1
+
+        self.pool.add(self.owner, pos, vel, self.maxtime, self.damage,
+                self.color)
 
-        self.bullets.add(
-                BulletEnt(pos, vel, self.maxtime, self.color)
-                )
+    def live(self):
+        """Returns the pool indices of this owner's bullets in flight"""
+        return self.pool.live(self.owner)
+
+    def release(self):
+        """Takes all of this owner's bullets out of flight"""
+        self.pool.release(self.owner)
 
     def update(self):
-        """Call this once a frame. Updates the position of all bullets and
-        removes any that have traveled their max distance
-        """
+        """Call this once a frame. The bullets themselves are moved by the
+        pool, this just counts down until the next shot is allowed"""
         if self._cooldown > 0:
             self._cooldown -= 1
-        toremove = []
-        for b in self.bullets:
-            b.update()
-            if b.ttl <= 0:
-                toremove.append(b)
 
-        for b in toremove:
-            self.bullets.remove(b)
-
-    def draw(self):
-        for b in self.bullets:
-            b.draw()
-
-# Is set upon first initialization of each color
-# maps color tuples to display list numbers
-bullet_dl = {}
-
-class BulletEnt(entity.Entity):
-    WRAPDIST = 25
-
-    def __init__(self, pos, vel, ttl, color):
-        super(BulletEnt, self).__init__(
-                None,
-                1
-                )
-        self.pos = numpy.array(pos, dtype=float)
-        self.velocity = vel
-        self.speed = numpy.linalg.norm(vel)
-
-        # Total time
-        self.ttl = ttl
-
-        try:
-            self.dl = bullet_dl[color]
-        except KeyError:
-            self.dl = util.get_displaylist()
-            glNewList(self.dl, GL_COMPILE)
-            glMaterialfv(GL_FRONT, GL_AMBIENT_AND_DIFFUSE, color)
-            glutSolidSphere(5, 5, 5)
-            glEndList()
-            bullet_dl[color] = self.dl
-
-
-    def update(self):
-        # update position
-        self.pos += self.velocity
-        self.ttl -= 1
-
-        if self.pos[0] > WIDTH + self.WRAPDIST:
-            self.pos[0] = -self.WRAPDIST
-        elif self.pos[0] < -self.WRAPDIST:
-            self.pos[0] = WIDTH + self.WRAPDIST
-
-        if self.pos[1] > HEIGHT + self.WRAPDIST:
-            self.pos[1] = -self.WRAPDIST
-        elif self.pos[1] < -self.WRAPDIST:
-            self.pos[1] = HEIGHT + self.WRAPDIST
-
-    def draw(self):
-        glPushMatrix()
-        glTranslated(*self.pos)
-        glCallList(self.dl)
-        glPopMatrix()
+# The pool all bullets are fired into
+pool = ProjectilePool()
+update = pool.update
+remember = pool.remember
+draw = pool.draw
@@ -0,0 +1,232 @@
+from __future__ import division
+"""
+Renders the game offscreen and streams every frame out as raw video.
+
+A Capture makes a framebuffer object the size of the field and draws into it
+instead of the window, so all it needs is a current context. Game.draw hands
+each finished frame to end_frame() instead of swapping buffers.
+
+python asteroids.py --capture makes that context with EGLContext, which
+needs no window or display, only an EGL driver such as Mesa's. PyOpenGL has
+to be on its EGL platform for that, which asteroids.py picks before importing
+OpenGL when given --capture. GLUT can't be used on it, so captured frames
+have no HUD text. Setting PYOPENGL_PLATFORM to something else, such as glx,
+captures from a hidden GLUT window instead, which does need a display.
+
+Reading pixels back straight after drawing them would wait for the GPU to
+finish the frame. Instead, each frame is read into the next of a ring of
+pixel buffer objects, which returns at once while the copy happens in the
+background. The oldest buffer in the ring, read RING-1 frames ago and long
+since filled, is the one mapped and handed on. Frames come out RING-1 frames
+late, and close() flushes the last of them.
+
+A writer thread flips frames the right way up and writes them out, so a slow
+disk or encoder doesn't hold up drawing until QUEUE frames are waiting.
+Frames are RGBA, 4 bytes a pixel, top row first, with nothing between them.
+For example, to encode them as they come:
+
+    python asteroids.py --capture "|ffmpeg -f rawvideo -pix_fmt rgba
+        -s 1000x800 -r 50 -i - out.mp4"
+
+"""
+import ctypes
+import subprocess
+import sys
+import threading
+import Queue
+
+from OpenGL.GL import *
+import OpenGL.platform
+# The plain entry point, which takes an offset into the bound pixel buffer
+# object where the wrapped one wants an array
+from OpenGL.raw.GL.VERSION.GL_1_0 import glReadPixels as _glReadPixels
+
+import numpy
+
+from asteroids import WIDTH, HEIGHT
+
+# Pixel buffer objects in the ring
+RING = 3
+
+# Frames waiting for the writer before end_frame() waits too
+QUEUE = 32
+
+def egl_available():
+    """Whether PyOpenGL is on its EGL platform, so EGLContext can be used"""
+    try:
+        from OpenGL.platform.egl import EGLPlatform
+    except ImportError:
+        return False
+    return isinstance(OpenGL.platform.PLATFORM, EGLPlatform)
+
+class EGLContext(object):
+    """A GL context with no window, made current on creation. Draws go to a
+    Capture's framebuffer, so its own surface is a single pixel"""
+    def __init__(self):
+        # Can only be imported on the EGL platform
+        from OpenGL import EGL
+        self._egl = EGL
+
+        self._display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+        major, minor = EGL.EGLint(), EGL.EGLint()
+        if not (self._display and EGL.eglInitialize(self._display,
+                ctypes.pointer(major), ctypes.pointer(minor))):
+            raise RuntimeError("Can't open an EGL display")
+
+        attributes = (EGL.EGLint * 5)(
+                EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT,
+                EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+                EGL.EGL_NONE)
+        config = EGL.EGLConfig()
+        count = EGL.EGLint()
+        if not (EGL.eglChooseConfig(self._display, attributes,
+                ctypes.pointer(config), 1, ctypes.pointer(count)) and
+                count.value):
+            raise RuntimeError("No EGL config for drawing with OpenGL")
+
+        size = (EGL.EGLint * 5)(EGL.EGL_WIDTH, 1, EGL.EGL_HEIGHT, 1,
+                EGL.EGL_NONE)
+        self._surface = EGL.eglCreatePbufferSurface(self._display, config,
+                size)
+        EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+        self._context = EGL.eglCreateContext(self._display, config,
+                EGL.EGL_NO_CONTEXT, None)
+        if not (self._surface and self._context and EGL.eglMakeCurrent(
+                self._display, self._surface, self._surface, self._context)):
+            raise RuntimeError("Can't make an offscreen EGL context")
+
+    def close(self):
+        EGL = self._egl
+        if self._display is None:
+            return
+        EGL.eglMakeCurrent(self._display, EGL.EGL_NO_SURFACE,
+                EGL.EGL_NO_SURFACE, EGL.EGL_NO_CONTEXT)
+        EGL.eglDestroyContext(self._display, self._context)
+        EGL.eglDestroySurface(self._display, self._surface)
+        EGL.eglTerminate(self._display)
+        self._display = None
+
+class Capture(object):
+    def __init__(self, output, width=WIDTH, height=HEIGHT, ring=RING):
+        """output is a file object, a filename, "-" for standard output, or
+        "|command" to pipe frames into a shell command. Needs a current GL
+        context, and leaves the capture's framebuffer bound"""
+        self.width = width
+        self.height = height
+        self._size = width * height * 4
+
+        self._process = None
+        if not isinstance(output, (str, unicode)):
+            self.file = output
+        elif output == "-":
+            self.file = sys.stdout
+        elif output.startswith("|"):
+            self._process = subprocess.Popen(output[1:], shell=True,
+                    stdin=subprocess.PIPE)
+            self.file = self._process.stdin
+        else:
+            self.file = open(output, 'wb')
+
+        # The framebuffer, with a color and a depth buffer
+        self._fbo = glGenFramebuffers(1)
+        glBindFramebuffer(GL_FRAMEBUFFER, self._fbo)
+        self._renderbuffers = glGenRenderbuffers(2)
+        for rb, storage, attachment in zip(self._renderbuffers,
+                (GL_RGBA8, GL_DEPTH_COMPONENT24),
+                (GL_COLOR_ATTACHMENT0, GL_DEPTH_ATTACHMENT)):
+            glBindRenderbuffer(GL_RENDERBUFFER, rb)
+            glRenderbufferStorage(GL_RENDERBUFFER, storage, width, height)
+            glFramebufferRenderbuffer(GL_FRAMEBUFFER, attachment,
+                    GL_RENDERBUFFER, rb)
+        glBindRenderbuffer(GL_RENDERBUFFER, 0)
+        if glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE:
+            raise RuntimeError("Can't render to an offscreen framebuffer")
+        glViewport(0, 0, width, height)
+
+        self._pbos = numpy.atleast_1d(glGenBuffers(ring))
+        for pbo in self._pbos:
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, pbo)
+            glBufferData(GL_PIXEL_PACK_BUFFER, self._size, None,
+                    GL_STREAM_READ)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+
+        # Frames drawn so far, and the oldest not yet handed to the writer
+        self.frames = 0
+        self._retired = 0
+
+        self._queue = Queue.Queue(QUEUE)
+        # What went wrong in the writer thread, if anything
+        self._error = None
+        self._writer = threading.Thread(target=self._write)
+        self._writer.daemon = True
+        self._writer.start()
+
+    def end_frame(self):
+        """Starts reading back the frame just drawn, and passes the oldest
+        one in the ring on to the writer"""
+        ring = len(self._pbos)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, self._pbos[self.frames % ring])
+        _glReadPixels(0, 0, self.width, self.height, GL_RGBA,
+                GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+        self.frames += 1
+
+        if self.frames - self._retired >= ring:
+            self._retire()
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+
+    def _retire(self):
+        """Maps the buffer of the oldest frame still in the ring and queues a
+        copy of it"""
+        glBindBuffer(GL_PIXEL_PACK_BUFFER,
+                self._pbos[self._retired % len(self._pbos)])
+        address = glMapBuffer(GL_PIXEL_PACK_BUFFER, GL_READ_ONLY)
+        try:
+            data = ctypes.string_at(address, self._size)
+        finally:
+            glUnmapBuffer(GL_PIXEL_PACK_BUFFER)
+        self._retired += 1
+        if self._error is not None:
+            raise self._error
+        self._queue.put(data)
+
+    def _write(self):
+        """The writer thread"""
+        while True:
+            data = self._queue.get()
+            if data is None:
+                return
+            if self._error is not None:
+                # Keep taking frames, so the drawing side never waits on a
+                # full queue. It raises the error instead
+                continue
+            # GL's rows go bottom to top
+            rows = numpy.frombuffer(data, numpy.uint8).reshape(self.height,
+                    self.width * 4)
+            try:
+                self.file.write(rows[::-1].tostring())
+            except (IOError, ValueError) as e:
+                self._error = e
+
+    def close(self):
+        """Writes out the frames still in the ring, waits for the writer to
+        finish, and goes back to drawing to the window"""
+        if self._fbo is None:
+            return
+        while self._retired < self.frames:
+            self._retire()
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+
+        self._queue.put(None)
+        self._writer.join()
+        if self.file is not sys.stdout:
+            self.file.close()
+        else:
+            self.file.flush()
+        if self._process is not None:
+            self._process.wait()
+
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        glDeleteBuffers(len(self._pbos), self._pbos)
+        glDeleteRenderbuffers(2, self._renderbuffers)
+        glDeleteFramebuffers(1, [self._fbo])
+        self._fbo = None
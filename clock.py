@@ -0,0 +1,56 @@
+from __future__ import division
+"""
+A fixed timestep clock, to keep the simulation rate apart from the frame rate.
+
+The game always advances in ticks of the same length, however often it gets
+drawn. Each time the clock is advanced it works out how many whole ticks of
+real time have passed since the last call and the game runs that many. What's
+left over carries on to the next call, and tells the renderer how far between
+the last two ticks the current moment is, so moving things can be drawn part
+of the way along.
+
+"""
+import timeit
+
+# Seconds of game time per tick. The game was written for a 20ms timer, so all
+# speeds are in units per 20ms
+TICK = 0.02
+
+# The most ticks to run in one go. If the machine can't keep up, the game
+# slows down instead of falling ever further behind trying to catch up
+MAX_TICKS = 5
+
+class Clock(object):
+    def __init__(self, tick=TICK, max_ticks=MAX_TICKS,
+            timer=timeit.default_timer):
+        self.tick = tick
+        self.max_ticks = max_ticks
+        self.timer = timer
+
+        # Real time not yet simulated, in seconds
+        self._accumulated = 0
+        self._last = None
+
+    def advance(self):
+        """Returns how many ticks to run to catch up with real time"""
+        now = self.timer()
+        if self._last is None:
+            self._last = now
+        self._accumulated += now - self._last
+        self._last = now
+
+        ticks = int(self._accumulated // self.tick)
+        if ticks > self.max_ticks:
+            # Drop the time we can't catch up on, keeping what's left of a
+            # tick
+            ticks = self.max_ticks
+            self._accumulated %= self.tick
+        else:
+            self._accumulated -= ticks * self.tick
+        return ticks
+
+    @property
+    def alpha(self):
+        """How far real time is between the last tick and the next one, from
+        0 to 1"""
+        return min(self._accumulated / self.tick, 1)
@@ -0,0 +1,142 @@
+from __future__ import division
+"""
+Batched collision detection.
+
+Rather than testing entities pair by pair, each group of entities (player
+bullets, asteroids, enemies, enemy bullets) is turned into an array of
+positions and an array of radii, and two groups are tested against each other
+all at once with hits(). The result is a pair of index arrays saying which
+members of each group touch.
+
+Small groups are compared with a single broadcasted squared-distance
+computation. When both groups are large, a uniform grid over the playing
+field is used to find the candidate pairs first, so the cost doesn't grow
+with the product of the two group sizes.
+
+"""
+import numpy
+
+from asteroids import WIDTH, HEIGHT
+
+# Above this many potential pairs, hits() goes through the grid instead of
+# comparing everything against everything
+BROADPHASE_MIN = 4096
+
+def arrays(entities):
+    """Returns a (positions, radii) pair of arrays for a sequence of
+    entities. positions is Nx3, radii has length N"""
+    n = len(entities)
+    pos = numpy.empty((n, 3), dtype=float)
+    rad = numpy.empty((n,), dtype=float)
+    for i, e in enumerate(entities):
+        pos[i] = e.pos
+        rad[i] = e.radius
+    return pos, rad
+
+def hits(pos_a, rad_a, pos_b, rad_b):
+    """Finds all touching pairs between group a and group b.
+
+    pos_a is an Nx3 array of positions and rad_a an array of N radii, and
+    likewise for group b. Returns two index arrays (ia, ib) of equal length;
+    for each k, member ia[k] of a touches member ib[k] of b. Pairs are ordered
+    by ia, then by ib.
+
+    """
+    na = len(pos_a)
+    nb = len(pos_b)
+    if na == 0 or nb == 0:
+        empty = numpy.empty((0,), dtype=int)
+        return empty, empty
+
+    if na * nb <= BROADPHASE_MIN:
+        # Compare everything at once
+        diff = pos_a[:, numpy.newaxis, :] - pos_b[numpy.newaxis, :, :]
+        dist2 = numpy.einsum('ijk,ijk->ij', diff, diff)
+        reach = rad_a[:, numpy.newaxis] + rad_b[numpy.newaxis, :]
+        return numpy.nonzero(dist2 < reach * reach)
+
+    grid = SpatialHash(rad_a.max() + rad_b.max())
+    ia, ib = grid.candidates(pos_a, pos_b)
+
+    diff = pos_a[ia] - pos_b[ib]
+    dist2 = numpy.einsum('ij,ij->i', diff, diff)
+    reach = rad_a[ia] + rad_b[ib]
+    touching = dist2 < reach * reach
+    return ia[touching], ib[touching]
+
+class SpatialHash(object):
+    """A uniform grid of cells covering the playing field.
+
+    The grid wraps around the same way the field does: entities past the right
+    edge (up to their WRAPDIST) land in the leftmost columns, and cells on
+    opposite edges count as neighbours. This means an entity that is about to
+    wrap is still found by queries from the other side of its cell boundary.
+
+    """
+    def __init__(self, cellsize):
+        """cellsize must be at least the largest sum of radii of any two
+        entities that will be tested against each other, so that any
+        colliding pair is at most one cell apart.
+        """
+        self.cols = max(1, int(WIDTH // cellsize))
+        self.rows = max(1, int(HEIGHT // cellsize))
+        # Stretch the cells so the grid exactly covers the field. This only
+        # ever makes cells bigger than asked for
+        self.cellw = WIDTH / self.cols
+        self.cellh = HEIGHT / self.rows
+
+    def _cells(self, pos):
+        """Returns the column and row arrays for an array of positions"""
+        cols = numpy.floor(pos[:, 0] / self.cellw).astype(int) % self.cols
+        rows = numpy.floor(pos[:, 1] / self.cellh).astype(int) % self.rows
+        return cols, rows
+
+    def _offsets(self, n):
+        """Neighbour offsets along an axis with n cells. On axes too small to
+        have 3 distinct neighbours, each cell is only visited once"""
+        if n >= 3:
+            return (-1, 0, 1)
+        return range(n)
+
+    def candidates(self, pos_a, pos_b):
+        """Returns index arrays (ia, ib) of every pair where member ib of b is
+        in the same cell as member ia of a, or in one of the 8 cells around
+        it. Pairs are ordered by ia, then by ib.
+        """
+        # Sort b by cell, so the members of any one cell are a contiguous run
+        col_b, row_b = self._cells(pos_b)
+        key_b = row_b * self.cols + col_b
+        order = numpy.argsort(key_b, kind='mergesort')
+        sorted_keys = key_b[order]
+
+        col_a, row_a = self._cells(pos_a)
+        index_a = numpy.arange(len(pos_a))
+
+        all_a = []
+        all_b = []
+        for dc in self._offsets(self.cols):
+            for dr in self._offsets(self.rows):
+                key = (((row_a + dr) % self.rows) * self.cols
+                        + (col_a + dc) % self.cols)
+                start = numpy.searchsorted(sorted_keys, key, 'left')
+                end = numpy.searchsorted(sorted_keys, key, 'right')
+                counts = end - start
+                total = counts.sum()
+                if not total:
+                    continue
+
+                # Expand each member of a into one entry per member of b in
+                # the neighbouring cell
+                all_a.append(numpy.repeat(index_a, counts))
+                firsts = numpy.cumsum(counts) - counts
+                within = numpy.arange(total) - numpy.repeat(firsts, counts)
+                all_b.append(order[numpy.repeat(start, counts) + within])
+
+        if not all_a:
+            empty = numpy.empty((0,), dtype=int)
+            return empty, empty
+
+        ia = numpy.concatenate(all_a)
+        ib = numpy.concatenate(all_b)
+        order = numpy.lexsort((ib, ia))
+        return ia[order], ib[order]
@@ -1,27 +1,48 @@
 from OpenGL.GL import *
+import functools
 import numpy
 
+import assets
 import entity
 import model
 import bullets
 import particle
+import renderqueue
+import util
 
 class Alien1(entity.Entity):
     """The first alien enemy. Slow. Shoots at the player every once in a
     while"""
 
+    modelfile = "alien_torus.obj"
     model = None
 
     # This alien's starting health
     health = 3
 
+    radius = 20
+
+    # The speed it heads for the player at, and how much of its speed it
+    # keeps each frame
+    speed = 3
+    drag = 0.995
+
+    # Frames until it first heads for the player, and between each time after
+    redirect_first = 100
+    redirect_interval = 200
+
+    # Frames until it first shoots at the player, and between each shot after
+    fire_first = 80
+    fire_interval = 80
+
     def __init__(self, target):
 
         if Alien1.model is None:
-            # Initialize the model for this ship
-            Alien1.model = model.ObjModel("alien_torus.obj", scale=10)
+            # Initialize the model for this ship. It's been built in the
+            # background since startup
+            Alien1.model = assets.get(Alien1.modelfile)
 
-        super(Alien1, self).__init__(Alien1.model, 20)
+        super(Alien1, self).__init__(Alien1.model, Alien1.radius)
 
         # This is who we're shooting at
         self.player = target
@@ -39,12 +60,14 @@ class Alien1(entity.Entity):
 
         # When this countdown reaches 0, the alien ship will re-direct itself
         # towards the player
-        self.redirect_countdown = 100
+        self.redirect_countdown = self.redirect_first
 
-        self.bullet_countdown = 80
+        self.bullet_countdown = self.fire_first
 
         self.bullets = bullets.Bullets(color=(1,0,0,1))
 
+        self.remember()
+
     def damage(self, amt):
         """Damages the alien.
         Returns True if the alien is destroyed.
@@ -68,21 +91,21 @@ class Alien1(entity.Entity):
         self.bullet_countdown -= 1
 
         # Gradually slow down our speed
-        self.vel *= 0.995
+        self.vel *= self.drag
 
         if self.redirect_countdown <= 0:
-            self.redirect_countdown = 200
+            self.redirect_countdown = self.redirect_interval
 
             newdir = self.player.pos - self.pos
             # normalize to a constant speed
             newdir /= numpy.linalg.norm(newdir)
-            newdir *= 3
+            newdir *= self.speed
 
             self.vel = newdir
 
         if self.bullet_countdown <= 0:
             # Fire a bullet towards the player
-            self.bullet_countdown = 80
+            self.bullet_countdown = self.fire_interval
 
             bulvel = self.player.pos - self.pos
             # normalize to a constant speed
@@ -94,21 +117,47 @@ class Alien1(entity.Entity):
 
 
 
-    def draw(self):
-        glPushMatrix()
-
-        # Translate to the right pos
-        glTranslated(*self.pos)
-
-        # Rotate slightly for a better view
-        #glRotated(20, 1, 0, 0)
-
-        # The turning rotations
-        glRotated(self.rot, 0, 1, 0)
-
-        # Finally, draw the thing
-        self.model.draw()
-
-        glPopMatrix()
-
-        self.bullets.draw()
+    # rot and health, then the countdowns to redirecting and to firing, the
+    # weapon's cooldown and its bullet owner
+    _STATE_FORMAT = "ddiiii"
+
+    def save_state(self, w):
+        """Writes everything about the alien that changes during a game to a
+        snapshot.Writer"""
+        w.values(self._STATE_FORMAT, self.rot, self.health,
+                self.redirect_countdown, self.bullet_countdown,
+                self.bullets._cooldown, self.bullets.owner)
+        w.array((self.pos, self.vel), "<f8")
+
+    def load_state(self, r):
+        """Reads back what save_state() wrote, from a snapshot.Reader"""
+        (self.rot, self.health, self.redirect_countdown,
+                self.bullet_countdown, self.bullets._cooldown,
+                self.bullets.owner) = r.values(self._STATE_FORMAT)
+        self.pos, self.vel = r.array("<f8", (3,))
+        self.remember()
+
+    def remember(self):
+        """Saves the current position and rotation, to draw from after the
+        next update"""
+        self._prev = (self.pos.copy(), self.rot)
+
+    def draw(self, alpha=1):
+        prev_pos, prev_rot = self._prev
+
+        renderqueue.submit(self.model, (
+            # Translate to the right pos
+            (renderqueue.TRANSLATE,
+                util.interpolate(prev_pos, self.pos, alpha)),
+            # The turning rotations
+            (renderqueue.ROTATE,
+                (util.interpolate(prev_rot, self.rot, alpha), 0, 1, 0)),
+            ))
+
+# Built in the background from startup. See assets.py
+assets.register(Alien1.modelfile, functools.partial(model.ObjModel,
+    Alien1.modelfile, scale=10, upload=False))
+
+# Every kind of enemy, for saving them in snapshots. Only add to the end, the
+# index is what gets saved
+TYPES = [Alien1]
@@ -2,10 +2,10 @@ from __future__ import division
 
 from OpenGL.GL import *
 
-import random
 import numpy
 import math
 
+import fastgl
 import model
 import particle
 
@@ -45,11 +45,16 @@ class FloatingEntity(Entity):
     constants each frame. Good for asteroids and debris
     """
     WRAPDIST = 30
-    def __init__(self, model, initpos, vel, radius, scale=1):
+    def __init__(self, model, initpos, vel, radius, scale=1, rng=None):
         """Create a new floating entity with the given model at the given
         initial position. It will have a the given velocity vel, in world units
         per frame.
+
+        rng is the numpy RandomState to draw the random rotation from. If
+        None, the global numpy.random is used.
         """
+        if rng is None:
+            rng = numpy.random
 
         assert len(initpos) == 3
         self.pos = numpy.array(initpos, dtype=float)
@@ -57,8 +62,8 @@ class FloatingEntity(Entity):
         self.scale = float(scale)
 
         # Generate a random axis of rotation
-        theta = random.uniform(0, 360)
-        phi = random.uniform(0, 180)
+        theta = rng.uniform(0, 360)
+        phi = rng.uniform(0, 180)
         rotaxis = [
                 math.cos(theta)*math.sin(phi),
                 math.sin(theta)*math.sin(phi),
@@ -67,7 +72,7 @@ class FloatingEntity(Entity):
         self.rotaxis = numpy.array(rotaxis, dtype=float)
 
         # Generate a random rotational velocity in degrees per frame
-        self.dtheta = random.uniform(-5, 5)
+        self.dtheta = rng.uniform(-5, 5)
 
         self.vel = numpy.array(vel, dtype=float)
 
@@ -75,22 +80,22 @@ class FloatingEntity(Entity):
 
     def draw(self):
         glMatrixMode(GL_MODELVIEW)
-        glPushMatrix()
+        fastgl.glPushMatrix()
 
         # Do translations
-        glTranslated(*self.pos)
+        fastgl.glTranslated(*self.pos)
 
         # Do scaling
         if self.scale != 1:
-            glScaled(self.scale, self.scale, self.scale)
+            fastgl.glScaled(self.scale, self.scale, self.scale)
 
         # Do rotation
-        glRotatef(self.rotangle, *self.rotaxis)
+        fastgl.glRotated(self.rotangle, *self.rotaxis)
 
         # draw the model
         self.model.draw()
 
-        glPopMatrix()
+        fastgl.glPopMatrix()
 
     def update(self):
         self.pos += self.vel
@@ -108,9 +113,9 @@ class FloatingEntity(Entity):
 
 class Asteroid(FloatingEntity):
     """Represents an asteroid on the field"""
-    asteroidmodelclass = model.AsteroidModel
+    variants = model.asteroid_variants
 
-    def __init__(self, size, maxvel, initialpos=None):
+    def __init__(self, size, maxvel, initialpos=None, rng=None):
         """Creates an asteroid randomly on the field with the specified size
         and maximum velocity
 
@@ -119,15 +124,22 @@ class Asteroid(FloatingEntity):
         If direction is specified, the asteroid is given a veloicty in the
         direction specified, with some variance.
 
+        rng is the numpy RandomState to draw from, the global numpy.random if
+        None.
+
         """
+        if rng is None:
+            rng = numpy.random
+        self.rng = rng
+
         # Generate a random starting pos
         # TODO: asteroids appear at the screen edge
         if initialpos is None:
-            initialpos = [random.uniform(0,WIDTH),
-                    random.uniform(0,HEIGHT), 0]
+            initialpos = [rng.uniform(0,WIDTH),
+                    rng.uniform(0,HEIGHT), 0]
 
         # generate a random velocity
-        vel = [random.uniform(-maxvel, maxvel) for _ in xrange(2)]
+        vel = [rng.uniform(-maxvel, maxvel) for _ in xrange(2)]
         vel.append(0)
 
         self.size = size
@@ -137,8 +149,10 @@ class Asteroid(FloatingEntity):
 
         self.WRAPDIST = scale*2
 
-        super(Asteroid, self).__init__(self.asteroidmodelclass(), initialpos, vel,
-                1.5*scale, scale)
+        asteroidmodel = self.variants.get(rng.randint(len(self.variants)))
+
+        super(Asteroid, self).__init__(asteroidmodel, initialpos, vel,
+                1.5*scale, scale, rng)
 
     def split(self):
         """Returns two new asteroids with the same momentum as this one."""
@@ -149,12 +163,13 @@ class Asteroid(FloatingEntity):
         split_range = self.radius / 2
         for _ in xrange(2):
             newpos = self.pos
-            newpos[:2] += numpy.random.uniform(-split_range, split_range, size=2)
+            newpos[:2] += self.rng.uniform(-split_range, split_range, size=2)
             newasteroids.append(
                     Asteroid(
                         self.size-1,
                         self.maxvel*1.1,
-                        newpos
+                        newpos,
+                        self.rng,
                         )
                     )
         return newasteroids
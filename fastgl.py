@@ -0,0 +1,64 @@
+from __future__ import division
+"""
+The GL calls made for every model drawn, called straight through ctypes.
+
+PyOpenGL's wrappers convert their arguments and check glGetError after every
+call, which costs more than the call itself. The functions here are the GL
+library's own entry points, with their argument types set so ctypes does the
+conversion, and nothing checked afterwards. Call them as fastgl.glTranslated
+and so on, not from names imported out of here, so set_debug() reaches every
+caller.
+
+With set_debug(True), or --gl-debug on the command line, they're PyOpenGL's
+checked wrappers again, so a bad call raises a GLError where it happens. The
+same goes for any entry point the GL library doesn't export by name.
+
+"""
+import ctypes
+
+import OpenGL.GL
+import OpenGL.platform
+
+# The entry points bound directly, and their argument types
+_SIGNATURES = dict(
+        glPushMatrix=(),
+        glPopMatrix=(),
+        glTranslated=(ctypes.c_double,) * 3,
+        glRotated=(ctypes.c_double,) * 4,
+        glScaled=(ctypes.c_double,) * 3,
+        glCallList=(ctypes.c_uint,),
+        glDrawArrays=(ctypes.c_uint, ctypes.c_int, ctypes.c_int),
+        )
+
+debug = False
+
+# The direct entry points, looked up the first time they're wanted
+_direct = {}
+
+def _bind(name):
+    """The GL library's own entry point for name, or None if it doesn't
+    export one"""
+    if name not in _direct:
+        try:
+            # Indexing makes a new function pointer, so setting its types
+            # doesn't touch one PyOpenGL has
+            func = OpenGL.platform.PLATFORM.GL[name]
+        except (AttributeError, TypeError):
+            func = None
+        else:
+            func.argtypes = _SIGNATURES[name]
+            func.restype = None
+        _direct[name] = func
+    return _direct[name]
+
+def set_debug(flag):
+    """Switches between the direct entry points and PyOpenGL's checked
+    ones"""
+    global debug
+    debug = flag
+    module = globals()
+    for name in _SIGNATURES:
+        func = None if debug else _bind(name)
+        module[name] = func or getattr(OpenGL.GL, name)
+
+set_debug(debug)
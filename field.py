@@ -0,0 +1,253 @@
+from __future__ import division
+"""
+Holds every asteroid on the playing field in one place.
+
+Instead of one Asteroid object per rock, each with its own little position and
+velocity arrays, the field keeps the state of all of them in parallel numpy
+arrays: row i of each array belongs to asteroid i. The whole field moves and
+wraps in a handful of array operations, so the cost of a frame doesn't grow
+with the number of Python objects on screen.
+
+"""
+from OpenGL.GL import *
+
+import numpy
+
+import model
+import particle
+import instancing
+import renderqueue
+import util
+
+from asteroids import WIDTH, HEIGHT
+
+def asteroid_scale(size):
+    """The scale factor of the model for an asteroid of the given size"""
+    return 3*size**2 + size*5
+
+# An asteroid's collision radius, and how far past the edge of the field it
+# drifts before wrapping around, as multiples of its scale
+RADIUS_SCALE = 1.5
+WRAPDIST_SCALE = 2
+
+# The fragments of a split asteroid are this much faster than it was
+SPLIT_SPEEDUP = 1.1
+
+class AsteroidField(object):
+    """A structure-of-arrays container of asteroids.
+
+    Asteroids are referred to by their row index. Indices are only valid until
+    the next call that adds or removes asteroids.
+
+    All randomness comes from rng, a numpy RandomState, so a field seeded the
+    same way always plays out the same. If None, the global numpy.random is
+    used.
+
+    """
+    variants = model.asteroid_variants
+
+    def __init__(self, rng=None):
+        if rng is None:
+            rng = numpy.random
+        self.rng = rng
+
+        self.pos = numpy.empty((0, 3), dtype=float)
+        self.vel = numpy.empty((0, 3), dtype=float)
+        self.rotaxis = numpy.empty((0, 3), dtype=float)
+        # Current rotation and rotational velocity, in degrees (per frame)
+        self.rotangle = numpy.empty((0,), dtype=float)
+        self.dtheta = numpy.empty((0,), dtype=float)
+
+        # size is an integer >= 1. The rest are derived from it, but kept
+        # around so they don't need computing each frame
+        self.size = numpy.empty((0,), dtype=int)
+        self.maxvel = numpy.empty((0,), dtype=float)
+        self.scale = numpy.empty((0,), dtype=float)
+        self.radius = numpy.empty((0,), dtype=float)
+        self.wrapdist = numpy.empty((0,), dtype=float)
+
+        # Which of the shared asteroid shapes each asteroid is drawn with
+        self.variant = numpy.empty((0,), dtype=int)
+
+        # Position and rotation as of the tick before, for drawing in between
+        # ticks. See remember()
+        self.prev_pos = numpy.empty((0, 3), dtype=float)
+        self.prev_rotangle = numpy.empty((0,), dtype=float)
+
+    def __len__(self):
+        return len(self.size)
+
+    def spawn(self, size, maxvel, count=1, pos=None):
+        """Adds count new asteroids of the given size with random velocities
+        up to maxvel in each direction.
+
+        size and maxvel may also be sequences of count values, one for each
+        new asteroid. pos may be a sequence of count positions. If it is
+        None, the asteroids are placed randomly on the field.
+
+        """
+        size = numpy.broadcast_to(size, (count,))
+        maxvel = numpy.broadcast_to(maxvel, (count,))
+
+        if pos is None:
+            # TODO: asteroids appear at the screen edge
+            pos = numpy.zeros((count, 3))
+            pos[:, 0] = self.rng.uniform(0, WIDTH, size=count)
+            pos[:, 1] = self.rng.uniform(0, HEIGHT, size=count)
+        else:
+            pos = numpy.array(pos, dtype=float).reshape((count, 3))
+
+        vel = numpy.zeros((count, 3))
+        vel[:, :2] = (self.rng.uniform(-1, 1, size=(count, 2))
+                * maxvel[:, numpy.newaxis])
+
+        # Generate random axes of rotation
+        theta = self.rng.uniform(0, 360, size=count)
+        phi = self.rng.uniform(0, 180, size=count)
+        rotaxis = numpy.column_stack((
+                numpy.cos(theta)*numpy.sin(phi),
+                numpy.sin(theta)*numpy.sin(phi),
+                numpy.cos(theta),
+                ))
+
+        # Random rotational velocities in degrees per frame
+        dtheta = self.rng.uniform(-5, 5, size=count)
+
+        scale = asteroid_scale(size)
+
+        variant = self.rng.randint(0, len(self.variants), size=count)
+
+        self._append(pos, vel, rotaxis, dtheta, size, maxvel, scale, variant)
+
+    def _append(self, pos, vel, rotaxis, dtheta, size, maxvel, scale, variant):
+        count = len(pos)
+        self.pos = numpy.concatenate((self.pos, pos))
+        self.vel = numpy.concatenate((self.vel, vel))
+        self.rotaxis = numpy.concatenate((self.rotaxis, rotaxis))
+        self.rotangle = numpy.concatenate((self.rotangle, numpy.zeros(count)))
+        self.dtheta = numpy.concatenate((self.dtheta, dtheta))
+
+        self.size = numpy.concatenate((self.size, size))
+        self.maxvel = numpy.concatenate((self.maxvel, maxvel))
+        self.scale = numpy.concatenate((self.scale, scale))
+        self.radius = numpy.concatenate((self.radius, RADIUS_SCALE*scale))
+        self.wrapdist = numpy.concatenate((self.wrapdist,
+            WRAPDIST_SCALE*scale))
+
+        self.variant = numpy.concatenate((self.variant, variant))
+
+        # New asteroids were never anywhere else
+        self.prev_pos = numpy.concatenate((self.prev_pos, pos))
+        self.prev_rotangle = numpy.concatenate((self.prev_rotangle,
+            numpy.zeros(count)))
+
+    def remove(self, indices):
+        """Removes the asteroids at the given indices"""
+        keep = numpy.ones(len(self), dtype=bool)
+        keep[indices] = False
+
+        self.pos = self.pos[keep]
+        self.vel = self.vel[keep]
+        self.rotaxis = self.rotaxis[keep]
+        self.rotangle = self.rotangle[keep]
+        self.dtheta = self.dtheta[keep]
+        self.size = self.size[keep]
+        self.maxvel = self.maxvel[keep]
+        self.scale = self.scale[keep]
+        self.radius = self.radius[keep]
+        self.wrapdist = self.wrapdist[keep]
+        self.variant = self.variant[keep]
+        self.prev_pos = self.prev_pos[keep]
+        self.prev_rotangle = self.prev_rotangle[keep]
+
+    def split(self, indices):
+        """Blows up the asteroids at the given indices. Each one bigger than
+        size 1 leaves behind two asteroids a size smaller, near where it was
+        and a bit faster.
+        """
+        indices = numpy.unique(indices)
+        if not len(indices):
+            return
+
+        particle.explosion(self.pos[indices], (1,1,1))
+
+        # Of the ones being blown up, these leave fragments
+        parents = indices[self.size[indices] > 1]
+
+        # Two fragments per parent
+        parents = numpy.repeat(parents, 2)
+        count = len(parents)
+        split_range = self.radius[parents, numpy.newaxis] / 2
+        newpos = self.pos[parents].copy()
+        newpos[:, :2] += (self.rng.uniform(-1, 1, size=(count, 2))
+                * split_range)
+        newsize = self.size[parents] - 1
+        newmaxvel = self.maxvel[parents] * SPLIT_SPEEDUP
+
+        self.remove(indices)
+        if count:
+            self.spawn(newsize, newmaxvel, count, newpos)
+
+    def update(self):
+        """Moves and spins every asteroid by its velocity, and wraps the ones
+        that have drifted past the edges of the field"""
+        self.pos += self.vel
+        self.rotangle += self.dtheta
+
+        wrapdist = self.wrapdist
+        for axis, limit in ((0, WIDTH), (1, HEIGHT)):
+            coord = self.pos[:, axis]
+            over = coord > limit + wrapdist
+            under = coord < -wrapdist
+            coord[over] = -wrapdist[over]
+            coord[under] = limit + wrapdist[under]
+
+    def save_state(self, w):
+        """Writes the field to a snapshot.Writer. Columns that follow from an
+        asteroid's size aren't written"""
+        w.array(numpy.column_stack((self.pos, self.vel, self.rotaxis,
+            self.rotangle, self.dtheta, self.maxvel)), "<f8")
+        w.array(numpy.column_stack((self.size, self.variant)), "<i4")
+
+    def load_state(self, r):
+        """Reads back what save_state() wrote, from a snapshot.Reader"""
+        floats = r.array("<f8", (12,))
+        ints = r.array("<i4", (2,))
+        self.pos = floats[:, 0:3].copy()
+        self.vel = floats[:, 3:6].copy()
+        self.rotaxis = floats[:, 6:9].copy()
+        self.rotangle = floats[:, 9].copy()
+        self.dtheta = floats[:, 10].copy()
+        self.maxvel = floats[:, 11].copy()
+        self.size = ints[:, 0].astype(int)
+        self.variant = ints[:, 1].astype(int)
+
+        self.scale = asteroid_scale(self.size).astype(float)
+        self.radius = RADIUS_SCALE*self.scale
+        self.wrapdist = WRAPDIST_SCALE*self.scale
+        self.remember()
+
+    def remember(self):
+        """Saves the current positions and rotations, to draw from after the
+        next update"""
+        self.prev_pos = self.pos.copy()
+        self.prev_rotangle = self.rotangle.copy()
+
+    def draw(self, alpha=1):
+        """Draws the field alpha of the way from where it was at the last
+        remember() to where it is now"""
+        pos = util.interpolate(self.prev_pos, self.pos, alpha)
+        rotangle = util.interpolate(self.prev_rotangle, self.rotangle, alpha)
+
+        if instancing.available():
+            renderqueue.submit_call(instancing.draw_field, self, pos, rotangle)
+            return
+
+        # Fall back to drawing them one at a time
+        for pos, scale, rotangle, rotaxis, variant in zip(pos,
+                self.scale, rotangle, self.rotaxis, self.variant):
+            renderqueue.submit(self.variants.get(variant), (
+                (renderqueue.TRANSLATE, pos),
+                (renderqueue.SCALE, (scale, scale, scale)),
+                (renderqueue.ROTATE, (rotangle,) + tuple(rotaxis)),
+                ))
@@ -0,0 +1,68 @@
+from __future__ import division, print_function
+"""
+Runs the game simulation without a window or an OpenGL context.
+
+Frames are stepped back to back as fast as the CPU allows, with no rendering
+and no 20ms timer in between. This is meant for balancing and regression runs
+on machines without a display.
+
+Usage: python headless.py [frames [profile.csv]]
+
+If a csv file is given, each frame is profiled and written to it, and the
+percentiles of each phase are printed at the end.
+
+"""
+import sys
+import time
+
+import util
+
+def run(frames, game=None, seed=None):
+    """Steps a game for the given number of frames and returns it.
+
+    If game is None, a new headless Game is created from seed. A game passed
+    in must have been created while util.headless was set.
+
+    """
+    util.headless = True
+
+    # Imported here, so this module can be imported without pulling in the
+    # whole game
+    import asteroids
+
+    if game is None:
+        game = asteroids.Game(seed=seed)
+
+    for _ in xrange(frames):
+        game.step()
+        game.profiler.end_frame(game)
+
+    return game
+
+def main():
+    if len(sys.argv) > 1:
+        frames = int(sys.argv[1])
+    else:
+        frames = 10000
+
+    game = None
+    if len(sys.argv) > 2:
+        util.headless = True
+        import asteroids
+        import profiler
+        game = asteroids.Game(profiler.Profiler(sys.argv[2]))
+
+    start = time.time()
+    game = run(frames, game)
+    elapsed = time.time() - start
+    game.profiler.close()
+
+    print("%d frames in %.2fs (%.0f frames/sec)" % (frames, elapsed,
+            frames / elapsed))
+    print("level %d, %d asteroids, %d enemies, %d lives" % (game.level,
+            len(game.asteroids), len(game.enemies), game.ship.lives))
+    for line in game.profiler.report():
+        print(line)
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,17 @@
 from OpenGL.GL import *
-from OpenGL.GLUT import *
+try:
+    from OpenGL.GLUT import glutBitmapCharacter, GLUT_BITMAP_9_BY_15
+except NotImplementedError:
+    # There are no GLUT fonts on the EGL platform, which captures are drawn
+    # on. The HUD goes without its text there
+    glutBitmapCharacter = None
 
 from util import get_displaylist
 
 def render_string(x, y, string):
     """Renders a string at the given pos"""
+    if glutBitmapCharacter is None:
+        return
     glRasterPos2d(x, y)
     for char in string:
         glutBitmapCharacter(GLUT_BITMAP_9_BY_15, ord(char))
@@ -81,6 +88,7 @@ class HUD(object):
         self.lives_dl = get_displaylist()
         self.shields_outline = get_displaylist()
         self.shields_level = get_displaylist()
+        self.overlay_dl = get_displaylist()
 
         # Create master display list
         self.master_dl = get_displaylist()
@@ -91,9 +99,12 @@ class HUD(object):
         glCallList(self.lives_dl)
         glCallList(self.shields_outline)
         glCallList(self.shields_level)
+        glCallList(self.overlay_dl)
         glCallList(dl_hud_restore)
         glEndList()
 
+        self.set_overlay([])
+
     def draw(self):
         """Draws the hud"""
         glCallList(self.master_dl)
@@ -142,3 +153,37 @@ class HUD(object):
         glEnd()
 
         glEndList()
+
+    def set_overlay(self, lines):
+        """Sets lines of text to show down the left side of the screen, such
+        as the profiler's report. An empty list hides the overlay"""
+        glNewList(self.overlay_dl, GL_COMPILE)
+        glColor3f(1.0, 1.0, 0.0)
+
+        y = 0.94
+        for line in lines:
+            render_string(0.01, y, line)
+            y -= 0.02
+
+        glEndList()
+
+class NullHUD(object):
+    """A stand-in for HUD that accepts the same updates but never touches
+    OpenGL. Used when running headless"""
+    def draw(self):
+        pass
+
+    def set_level(self, level):
+        pass
+
+    def set_lives(self, lives):
+        pass
+
+    def set_shields(self, amt):
+        pass
+
+    def set_shields_max(self, upper):
+        pass
+
+    def set_overlay(self, lines):
+        pass
@@ -0,0 +1,192 @@
+from __future__ import division
+"""
+Instanced drawing of the asteroid field.
+
+Drawing asteroids one at a time costs a push, translate, scale, rotate, draw
+and pop for each of them. Instead, the position, scale and rotation of every
+asteroid are packed into one array and uploaded as per-instance vertex
+attributes. A small vertex shader applies each instance's transform, and all
+the asteroids sharing a shape are drawn in a single instanced call.
+
+The shader does the same per-vertex lighting that the fixed function pipeline
+would, from the current material and GL_LIGHT0, so asteroids look the same
+either way. Where instancing or shaders aren't available (needs OpenGL 3.3 or
+the ARB_instanced_arrays extension), available() returns False and the field
+falls back to drawing asteroids one by one.
+
+"""
+from OpenGL.GL import *
+
+import ctypes
+import numpy
+
+VERTEX_SHADER = """
+#version 120
+
+// xyz is the position of the instance, w its scale
+attribute vec4 offset_scale;
+// xyz is the axis of rotation, w the angle in degrees
+attribute vec4 axis_angle;
+
+varying vec4 color;
+
+// The same rotation matrix as glRotate
+mat3 rotation(vec3 axis, float degrees)
+{
+    vec3 u = normalize(axis);
+    float c = cos(radians(degrees));
+    float s = sin(radians(degrees));
+    float t = 1.0 - c;
+    return mat3(
+        t*u.x*u.x + c,     t*u.x*u.y + s*u.z, t*u.x*u.z - s*u.y,
+        t*u.x*u.y - s*u.z, t*u.y*u.y + c,     t*u.y*u.z + s*u.x,
+        t*u.x*u.z + s*u.y, t*u.y*u.z - s*u.x, t*u.z*u.z + c);
+}
+
+void main()
+{
+    mat3 r = rotation(axis_angle.xyz, axis_angle.w);
+    vec3 world = offset_scale.xyz + offset_scale.w * (r * gl_Vertex.xyz);
+    gl_Position = gl_ModelViewProjectionMatrix * vec4(world, 1.0);
+
+    // Ambient plus diffuse from the directional GL_LIGHT0
+    vec3 n = normalize(gl_NormalMatrix * (r * gl_Normal));
+    vec3 l = normalize(gl_LightSource[0].position.xyz);
+    color = gl_FrontLightModelProduct.sceneColor
+        + gl_FrontLightProduct[0].ambient
+        + max(dot(n, l), 0.0) * gl_FrontLightProduct[0].diffuse;
+    color.a = gl_FrontMaterial.diffuse.a;
+}
+"""
+
+FRAGMENT_SHADER = """
+#version 120
+
+varying vec4 color;
+
+void main()
+{
+    gl_FragColor = color;
+}
+"""
+
+# Attribute locations for the per-instance data. These stay clear of the
+# locations some drivers alias to gl_Vertex, gl_Normal and gl_Color
+OFFSET_SCALE = 6
+AXIS_ANGLE = 7
+
+# Bytes per instance: two vec4s of floats
+STRIDE = 8 * 4
+
+class _Instancer(object):
+    def __init__(self):
+        # None until the first attempt to set up, then True or False
+        self._ok = None
+        self.program = None
+        self.vbo = None
+
+    def available(self):
+        """Returns True if instanced drawing works with the current context.
+        The first call compiles the shaders, so it needs a current context"""
+        if self._ok is None:
+            self._ok = self._setup()
+        return self._ok
+
+    def _setup(self):
+        for func in (glDrawArraysInstanced, glVertexAttribDivisor,
+                glCreateShader):
+            if not bool(func):
+                return False
+        try:
+            program = glCreateProgram()
+            for kind, source in ((GL_VERTEX_SHADER, VERTEX_SHADER),
+                    (GL_FRAGMENT_SHADER, FRAGMENT_SHADER)):
+                shader = glCreateShader(kind)
+                glShaderSource(shader, source)
+                glCompileShader(shader)
+                if not glGetShaderiv(shader, GL_COMPILE_STATUS):
+                    return False
+                glAttachShader(program, shader)
+            glBindAttribLocation(program, OFFSET_SCALE, "offset_scale")
+            glBindAttribLocation(program, AXIS_ANGLE, "axis_angle")
+            glLinkProgram(program)
+            if not glGetProgramiv(program, GL_LINK_STATUS):
+                return False
+        except GLError:
+            return False
+
+        self.program = program
+        self.vbo = glGenBuffers(1)
+        return True
+
+    def _upload(self, instances):
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glBufferData(GL_ARRAY_BUFFER, instances.nbytes, instances,
+                GL_STREAM_DRAW)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def _begin(self):
+        glUseProgram(self.program)
+        glEnableVertexAttribArray(OFFSET_SCALE)
+        glEnableVertexAttribArray(AXIS_ANGLE)
+        glVertexAttribDivisor(OFFSET_SCALE, 1)
+        glVertexAttribDivisor(AXIS_ANGLE, 1)
+
+    def _draw_run(self, model, first, count):
+        """Draws model once for each of count instances in the uploaded
+        buffer, starting at instance first"""
+        # Point the instance attributes at this run
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glVertexAttribPointer(OFFSET_SCALE, 4, GL_FLOAT, GL_FALSE,
+                STRIDE, ctypes.c_void_p(first * STRIDE))
+        glVertexAttribPointer(AXIS_ANGLE, 4, GL_FLOAT, GL_FALSE,
+                STRIDE, ctypes.c_void_p(first * STRIDE + 16))
+        model.draw_instanced(count)
+
+    def _end(self):
+        glVertexAttribDivisor(OFFSET_SCALE, 0)
+        glVertexAttribDivisor(AXIS_ANGLE, 0)
+        glDisableVertexAttribArray(OFFSET_SCALE)
+        glDisableVertexAttribArray(AXIS_ANGLE)
+        glUseProgram(0)
+
+    def draw_instances(self, model, instances):
+        """Draws an ObjModel once for each row of instances, an Nx8 float32
+        array of position, scale, rotation axis and rotation angle"""
+        if not len(instances):
+            return
+        self._upload(instances)
+        self._begin()
+        self._draw_run(model, 0, len(instances))
+        self._end()
+
+    def draw_field(self, field, pos, rotangle):
+        """Draws every asteroid in an AsteroidField, one instanced call per
+        shape. pos and rotangle are where to draw them, one row per asteroid"""
+        count = len(field)
+        if not count:
+            return
+
+        # Sort the instances by shape, so each shape's instances are one
+        # contiguous run of the buffer
+        order = numpy.argsort(field.variant, kind='mergesort')
+        instances = numpy.empty((count, 8), dtype=numpy.float32)
+        instances[:, :3] = pos[order]
+        instances[:, 3] = field.scale[order]
+        instances[:, 4:7] = field.rotaxis[order]
+        instances[:, 7] = rotangle[order]
+        runs = numpy.bincount(field.variant, minlength=len(field.variants))
+
+        self._upload(instances)
+        self._begin()
+        first = 0
+        for variant, run in enumerate(runs):
+            if run:
+                self._draw_run(field.variants.get(variant), first, run)
+            first += run
+        self._end()
+
+_instancer = _Instancer()
+available = _instancer.available
+draw_instances = _instancer.draw_instances
+draw_field = _instancer.draw_field
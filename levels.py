@@ -1,6 +1,5 @@
 from __future__ import division
 
-import entity
 import enemy
 
 """
@@ -13,26 +12,20 @@ class Level(object):
         self.asteroids = asteroids
         self.aliens = aliens
 
-        self.aliens_entered = 0
-
-    def create_asteroids(self):
-        """Returns a set of asteroid objects"""
+    def create_asteroids(self, field):
+        """Adds this level's asteroids to the given field.AsteroidField"""
         maxspeed = self.speed
 
-        asteroids = set()
-
         for size, count in enumerate(self.asteroids):
             size += 1 # sizes start at 1
-            for _ in xrange(count):
-                asteroids.add( entity.Asteroid(size, maxspeed) )
-
-        return asteroids
-
-    def enter_alien(self, target):
-        """Returns a new alien object if one is to enter at this point"""
-        if len(self.aliens) > self.aliens_entered:
-            alien_type = self.aliens[self.aliens_entered]
-            self.aliens_entered += 1
+            if count:
+                field.spawn(size, maxspeed, count)
+
+    def enter_alien(self, target, entered):
+        """Returns a new alien object if one is to enter at this point.
+        entered is how many aliens have entered so far this level"""
+        if len(self.aliens) > entered:
+            alien_type = self.aliens[entered]
 
             alien_class = [
                     None,
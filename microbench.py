@@ -0,0 +1,273 @@
+from __future__ import division, print_function
+"""
+Microbenchmarks for the hot paths of the simulation and asset loading.
+
+Everything runs with util.headless set, so no window or OpenGL context is
+needed: models are parsed but never uploaded, and the HUD is a NullHUD.
+
+Each benchmark is timed over a number of trials. A trial gets fresh state
+from the benchmark's setup, then calls the function under test enough times
+to take at least MIN_TRIAL_TIME, so timer resolution doesn't matter. The
+garbage collector is off while timing, as timeit does. The per-call times of
+all trials are summarized in the JSON results; min and median are the ones to
+compare between runs.
+
+Usage: python microbench.py [-n trials] [-o results.json] [name ...]
+
+Only benchmarks whose name contains one of the given names are run.
+
+"""
+import argparse
+import gc
+import glob
+import json
+import math
+import os
+import platform
+import sys
+import timeit
+
+import numpy
+
+import util
+util.headless = True
+
+import asteroids
+import entity
+import field
+import collision
+import particle
+import bullets
+import bezier
+import model
+import ship
+import hud
+
+# Trials per benchmark, not counting a warm-up trial
+TRIALS = 10
+
+# The shortest a single trial may take, in seconds
+MIN_TRIAL_TIME = 0.02
+
+_timer = timeit.default_timer
+
+# Each benchmark is a function that sets up fresh state and returns the
+# function to time, which takes no arguments
+BENCHMARKS = []
+
+def benchmark(name):
+    def register(setup):
+        BENCHMARKS.append((name, setup))
+        return setup
+    return register
+
+@benchmark("entity.check_collide")
+def _check_collide():
+    a = entity.Asteroid(3, 1)
+    b = entity.Asteroid(2, 1)
+    return lambda: entity.check_collide(a, b)
+
+@benchmark("FloatingEntity.update")
+def _floating_update():
+    return entity.Asteroid(3, 1).update
+
+@benchmark("Asteroid.split")
+def _asteroid_split():
+    return entity.Asteroid(3, 1).split
+
+@benchmark("AsteroidField.update[500]")
+def _field_update():
+    f = field.AsteroidField()
+    f.spawn(1, 1, 500)
+    return f.update
+
+@benchmark("AsteroidField.split[500]")
+def _field_split():
+    f = field.AsteroidField()
+    f.spawn(3, 1, 500)
+    # Each call blows up the first ten of the same 500. split() makes new
+    # arrays rather than changing the old ones, so putting the old ones back
+    # restores the field
+    start = dict(f.__dict__)
+    indices = numpy.arange(10)
+    def split():
+        f.__dict__.update(start)
+        f.split(indices)
+    return split
+
+@benchmark("collision.hits[500x100]")
+def _collision_hits():
+    f = field.AsteroidField()
+    f.spawn(1, 1, 500)
+    pos = numpy.zeros((100, 3))
+    pos[:, 0] = numpy.random.uniform(0, asteroids.WIDTH, 100)
+    pos[:, 1] = numpy.random.uniform(0, asteroids.HEIGHT, 100)
+    rad = numpy.ones(100)
+    return lambda: collision.hits(pos, rad, f.pos, f.radius)
+
+@benchmark("Ship.direction")
+def _ship_direction():
+    s = ship.Ship(hud.NullHUD())
+    s.theta = 37
+    s.phi = 12
+    return s.direction
+
+@benchmark("bezier.Quadratic.B")
+def _bezier():
+    p0 = numpy.array([600, 400, 1000, 90, -90], dtype=float)
+    p1 = numpy.array([600, 400, 300, 90, -80], dtype=float)
+    p2 = numpy.array([500, 400, 0, 90, 0], dtype=float)
+    curve = bezier.Quadratic(p0, p1, p2, 100)
+    return lambda: curve.B(37)
+
+@benchmark("Particles.update")
+def _particles_update():
+    p = particle.Particles()
+    for _ in xrange(100):
+        p.explosion((500, 400, 0), (1, 1, 1))
+    return p.update
+
+@benchmark("Particles.thrust")
+def _particles_thrust():
+    p = particle.Particles()
+    pos = numpy.array([500, 400, 0], dtype=float)
+    direction = numpy.array([0, 1, 0], dtype=float)
+    return lambda: p.thrust(pos, direction)
+
+@benchmark("Particles.explosion")
+def _particles_explosion():
+    p = particle.Particles()
+    return lambda: p.explosion((500, 400, 0), (1, 1, 1))
+
+@benchmark("ProjectilePool.update[full]")
+def _pool_update():
+    pool = bullets.ProjectilePool()
+    owner = pool.new_owner()
+    for i in xrange(pool.size):
+        # Long lived, so the pool stays full for the whole trial
+        pool.add(owner, (i % asteroids.WIDTH, i % asteroids.HEIGHT, 0),
+                (1, 1, 0), 10**9, 1, (0, 1, 0, 1))
+    return pool.update
+
+def _obj_files():
+    """The shipped obj files that can be loaded. Some refer to material
+    libraries that aren't shipped"""
+    names = []
+    for filename in sorted(glob.glob("*.obj")):
+        try:
+            model.ObjModel.__new__(model.ObjModel)._parse_model(
+                    open(filename, 'r'))
+        except (IOError, OSError):
+            continue
+        names.append(filename)
+    return names
+
+def _register_parsers():
+    for filename in _obj_files():
+        def parse(filename=filename):
+            m = model.ObjModel.__new__(model.ObjModel)
+            # A file object bypasses the parse cache
+            return lambda: m._parse_model(open(filename, 'r'))
+        def cached(filename=filename):
+            m = model.ObjModel.__new__(model.ObjModel)
+            # Make sure the cache is there to be loaded
+            m._parse_model(filename)
+            return lambda: m._parse_model(filename)
+        benchmark("ObjModel._parse_model[%s]" % filename)(parse)
+        benchmark("ObjModel._parse_model[%s,cached]" % filename)(cached)
+
+def summarize(times):
+    """Statistics of a list of timings, in seconds"""
+    times = numpy.array(times, dtype=float)
+    q1, median, q3 = numpy.percentile(times, (25, 50, 75))
+    mean = times.mean()
+    stdev = times.std(ddof=1) if len(times) > 1 else 0.0
+    return dict(
+            min=times.min(),
+            max=times.max(),
+            median=median,
+            iqr=q3 - q1,
+            mean=mean,
+            stdev=stdev,
+            # Half-width of a 95% confidence interval of the mean
+            ci95=1.96 * stdev / math.sqrt(len(times)),
+            )
+
+def _time(func, loops):
+    start = _timer()
+    for _ in xrange(loops):
+        func()
+    return _timer() - start
+
+def run_benchmark(setup, trials=TRIALS):
+    """Times the function returned by setup, as described at the top of this
+    file. Returns a dict of per-call statistics"""
+    gcwas = gc.isenabled()
+    gc.disable()
+    try:
+        # Find how many calls a trial needs. This doubles as a warm-up
+        func = setup()
+        loops = 1
+        while _time(func, loops) < MIN_TRIAL_TIME:
+            loops *= 2
+
+        times = []
+        for _ in xrange(trials):
+            func = setup()
+            times.append(_time(func, loops) / loops)
+    finally:
+        if gcwas:
+            gc.enable()
+
+    result = summarize(times)
+    result.update(loops=loops, trials=trials)
+    return result
+
+def run(names=None, trials=TRIALS, out=sys.stdout):
+    """Runs the benchmarks whose names contain one of names, or all of them,
+    and returns the results"""
+    results = {}
+    for name, setup in BENCHMARKS:
+        if names and not any(n in name for n in names):
+            continue
+        # Each benchmark starts from the same random state
+        numpy.random.seed(0)
+        results[name] = result = run_benchmark(setup, trials)
+        if out is not None:
+            print("%-45s %10.2fus  (median %.2fus, +-%.2fus)" % (name,
+                result['min'] * 1e6, result['median'] * 1e6,
+                result['ci95'] * 1e6), file=out)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(
+            description="Time the simulation and asset hot paths")
+    parser.add_argument("-n", "--trials", type=int, default=TRIALS)
+    parser.add_argument("-o", "--output",
+            help="file to write JSON results to")
+    parser.add_argument("names", nargs="*",
+            help="only run benchmarks whose names contain one of these")
+    args = parser.parse_args()
+
+    # Models and their materials are found relative to the game's directory
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    _register_parsers()
+
+    results = dict(
+            python=platform.python_version(),
+            numpy=numpy.__version__,
+            platform=platform.platform(),
+            trials=args.trials,
+            min_trial_time=MIN_TRIAL_TIME,
+            benchmarks=run(args.names, args.trials),
+            )
+
+    if args.output:
+        f = open(args.output, 'w')
+        try:
+            json.dump(results, f, indent=2, sort_keys=True)
+        finally:
+            f.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,52 @@
 from OpenGL.GL import *
-from OpenGL.GLUT import glutSolidSphere
 
-import random
+import ctypes
+import functools
+import json
+import os
+import re
+import threading
 import numpy
-from collections import defaultdict
+import assets
+import fastgl
 import util
 
+# Parsed obj files are cached next to the original, with this appended to the
+# name. Bump the version whenever the layout of the cache changes
+CACHE_SUFFIX = ".cache"
+CACHE_VERSION = 2
+
+# Pieces of an obj file that are pulled out of the whole text at once
+_VERTEX = re.compile(r"^v\s+(.*)$", re.M)
+_NORMAL = re.compile(r"^vn\s+(.*)$", re.M)
+_FACE = re.compile(r"^f\s+(.*)$", re.M)
+_MTLLIB = re.compile(r"^mtllib\s+(.*)$", re.M)
+_USEMTL = re.compile(r"^usemtl\s+(\S+).*$", re.M)
+
+def _parse_floats(strings):
+    """Reads all the whitespace separated numbers in a list of strings into
+    one flat array"""
+    return numpy.fromstring(" ".join(strings), dtype=float, sep=" ")
+
+def _parse_ints(string):
+    return numpy.fromstring(string, dtype=int, sep=" ")
+
+def _triangulate(corners, sizes):
+    """Splits each face into a fan of triangles around its first corner, the
+    same as GL_POLYGON does for the convex faces in our models. Returns the
+    corners of the triangles"""
+    starts = numpy.cumsum(sizes) - sizes
+    triangles = sizes - 2
+    total = triangles.sum()
+    # For each triangle, the face it comes from and which one it is in that
+    # face's fan
+    firsts = numpy.repeat(starts, triangles)
+    within = numpy.arange(total) - numpy.repeat(
+            numpy.cumsum(triangles) - triangles, triangles)
+    indices = numpy.column_stack((firsts, firsts + within + 1,
+        firsts + within + 2))
+    return corners[indices.ravel()]
+
 class Model(object):
     """A model that can be drawn on the screen"""
 
@@ -16,6 +57,9 @@ class Model(object):
         """Create the display list.
         Sub-classes *should* call this sometime during the initialization
         """
+        if util.headless:
+            self.renderlist = None
+            return
         self.renderlist = util.get_displaylist()
         glNewList(self.renderlist, GL_COMPILE)
         if scale != 1:
@@ -34,10 +78,13 @@ class Model(object):
         raise NotImplementedError()
     
     def draw(self):
-        glCallList(self.renderlist)
+        fastgl.glCallList(self.renderlist)
 
 class Sphere(Model):
     def render(self):
+        # Imported here, so that importing this module doesn't need GLUT,
+        # which can't be used on the EGL platform
+        from OpenGL.GLUT import glutSolidSphere
         glMaterialfv(GL_FRONT, GL_AMBIENT_AND_DIFFUSE, (1,0,0,0))
         glutSolidSphere(5, 5, 5)
 
@@ -63,76 +110,86 @@ class _Material(object):
         #glMaterialfv(GL_FRONT, GL_EMISSION, self.emission)
 
 class ObjModel(Model):
-    """A model loaded from an obj file"""
-    def __init__(self, fileobj, scale=1):
+    """A model loaded from an obj file.
+
+    Rather than a display list, the polygons are broken into triangles and
+    uploaded once into a vertex buffer object, holding an interleaved normal
+    and vertex for each corner. The triangles of each material are kept
+    together, so drawing is one glDrawArrays call per material.
+
+    """
+    # Bytes per corner in the vertex buffer: a normal, then a vertex, each
+    # three floats
+    STRIDE = 6 * 4
+
+    def __init__(self, fileobj, scale=1, upload=True):
+        """With upload False, nothing touches GL, and the model can't be
+        drawn until upload() has sent all of it"""
         self._parse_model(fileobj)
-        self._create_displaylist(scale)
+        self._create_buffers(scale, upload)
 
     def _parse_model(self, fileobj):
+        """Parses an obj file, given as a file object or a filename.
+
+        Afterwards, self.vertices and self.normals are arrays of the points
+        the faces refer to, and self.groups is a list of (material, corners,
+        sizes) tuples in file order. corners is an array with a row of
+        (vertex index, normal index) for each corner of each face in the
+        group, and sizes says how many corners each face has.
+
+        When given a filename, the result is cached next to the file and
+        reused until the obj file or any of its materials change.
+
+        """
+        filename = None
         if isinstance(fileobj, (str, unicode)):
-            fileobj = open(fileobj, 'r')
+            filename = fileobj
+            if self._load_cache(filename):
+                return
+            fileobj = open(filename, 'r')
 
-        # Internal list of ordered points referenced by the face definitions.
-        # These arrays start at 1.
-        self.vertices = [None]
-        self.normals = [None]
+        try:
+            text = fileobj.read()
+        finally:
+            fileobj.close()
 
         # The material map. Maps material names to _Material objects
         self.mats = {}
-
-        # Stores all the ploygons for this model
-        # Keys are material names
-        # Each value is a polygon list
-        # Each polygon list item is a tuple: (triangles, quadralaterals, polygons).
-        # Each of those is a list of (vertex, normal), where normal
-        # and vertex are numpy vectors. Together, the list of points define a
-        # single polygon
-        self.polys = defaultdict(lambda: ([],[],[]))
-        currentmat = None
-
-        for line in fileobj:
-            if not line.strip():
+        self.mtllibs = []
+        for line in _MTLLIB.findall(text):
+            for matfilename in line.split():
+                self.mtllibs.append(matfilename)
+                self._parsemat(matfilename)
+
+        self.vertices = _parse_floats(_VERTEX.findall(text)).reshape((-1, 3))
+        self.normals = _parse_floats(_NORMAL.findall(text)).reshape((-1, 3))
+
+        # Cut the file wherever the material changes. This gives the text
+        # before the first usemtl, followed by pairs of material names and the
+        # text they apply to
+        chunks = _USEMTL.split(text)
+        materials = [None] + chunks[1::2]
+
+        self.groups = []
+        for material, chunk in zip(materials, chunks[::2]):
+            if material is not None and material not in self.mats:
+                raise KeyError(material)
+            faces = _FACE.findall(chunk)
+            if not faces:
                 continue
-            lineparts = line.strip().split()
-
-            if lineparts[0] == "v":
-                # Define a vertex
-                _, p1, p2, p3 = line.split()
-                self.vertices.append(numpy.array((float(p1), float(p2), float(p3))))
-
-            elif lineparts[0] == "vn":
-                _, p1, p2, p3 = line.split()
-                self.normals.append(numpy.array((float(p1), float(p2), float(p3))))
-
-            elif lineparts[0] == "mtllib":
-                for filename in lineparts[1:]:
-                    self._parsemat(filename)
-
-            elif lineparts[0] == "usemtl":
-                currentmat = self.mats[line.split()[1]]
-
-            elif lineparts[0] == "f":
-                # Define a single polygon
-                face_components = line.split(None, 1)[1].split()
-                # Go over each point in this polygon and gather them in this
-                # list
-                points = []
-                for component in face_components:
-                    # one vertex component of this polygon
-                    point, texture, normal = component.split("/")
-                    vertex = self.vertices[int(point)]
-                    normalv = self.normals[int(normal)]
-                    points.append((vertex, normalv))
-
-                # Now that all points have been parsed and mapped for this
-                # polygon, put it in the polygon list for the current material
-                if len(points) == 3:
-                    i = 0
-                elif len(points) == 4:
-                    i = 1
-                else:
-                    i = 2
-                self.polys[currentmat][i].append(points)
+            # Each corner is point/texture/normal, where texture may be left
+            # out. We don't use textures, so mark missing ones as 0 and then
+            # read every number in the chunk at once
+            corners = _parse_ints(" ".join(faces).replace("//", "/0/")
+                    .replace("/", " ")).reshape((-1, 3))
+            # obj indices start at 1
+            corners = corners[:, ::2] - 1
+            # Every corner has two slashes
+            sizes = numpy.array([face.count("/") for face in faces]) // 2
+            self.groups.append((material, corners, sizes))
+
+        if filename is not None:
+            self._save_cache(filename)
 
     def _parsemat(self, matfilename):
         f = open(matfilename, 'r')
@@ -171,65 +228,351 @@ class ObjModel(Model):
         finally:
             f.close()
 
-    def render(self):
-        # Draw polygons
-        for texture, polygons in self.polys.iteritems():
-            if texture:
-                texture.activate()
-            triangles, quads, polys = polygons
-            if triangles:
-                glBegin(GL_TRIANGLES)
-                for (pt1,n1),(pt2,n2),(pt3,n3) in triangles:
-                    glNormal3dv(n1)
-                    glVertex3dv(pt1)
-                    glNormal3dv(n2)
-                    glVertex3dv(pt2)
-                    glNormal3dv(n3)
-                    glVertex3dv(pt3)
-                glEnd()
-
-            if quads:
-                glBegin(GL_QUADS)
-                for (pt1,n1),(pt2,n2),(pt3,n3),(pt4,n4) in quads:
-                    glNormal3dv(n1)
-                    glVertex3dv(pt1)
-                    glNormal3dv(n2)
-                    glVertex3dv(pt2)
-                    glNormal3dv(n3)
-                    glVertex3dv(pt3)
-                    glNormal3dv(n4)
-                    glVertex3dv(pt4)
-                glEnd()
-
-            for p in polys:
-                glBegin(GL_POLYGON)
-                for pt, n in p:
-                    glNormal3dv(n)
-                    glVertex3dv(pt)
-                glEnd()
+    def _stamps(self, filenames):
+        """The modification time and size of each file, for telling whether a
+        cache is stale"""
+        stamps = []
+        for filename in filenames:
+            st = os.stat(filename)
+            stamps.append([st.st_mtime, st.st_size])
+        return stamps
+
+    def _load_cache(self, filename):
+        """Loads a parsed model saved by _save_cache. Returns False, leaving
+        the model untouched, if there is no cache or it is out of date"""
+        try:
+            f = open(filename + CACHE_SUFFIX, 'rb')
+        except IOError:
+            return False
+        try:
+            header = json.loads(f.readline())
+            if header['version'] != CACHE_VERSION:
+                return False
+            mtllibs = [str(name) for name in header['mtllibs']]
+            if self._stamps([filename] + mtllibs) != header['stamps']:
+                return False
+
+            # The arrays follow the header, one after another
+            data = f.read()
+            arrays = {}
+            offset = 0
+            for name, dtype, shape in header['arrays']:
+                count = int(numpy.prod(shape))
+                if count:
+                    array = numpy.frombuffer(data, dtype, count, offset)
+                else:
+                    array = numpy.empty(0, dtype)
+                arrays[name] = array.reshape(shape)
+                offset += array.nbytes
+            if offset != len(data):
+                return False
+
+            mats = {}
+            for name, values in header['mats'].iteritems():
+                mats[str(name)] = _Material(*values)
+
+            # Cut the flat corner and size arrays back up into groups
+            groups = []
+            corners = arrays['corners']
+            sizes = arrays['sizes']
+            faces_start = corners_start = 0
+            for material, count in header['groups']:
+                faces_end = faces_start + count
+                group_sizes = sizes[faces_start:faces_end]
+                corners_end = corners_start + group_sizes.sum()
+                groups.append((material and str(material),
+                    corners[corners_start:corners_end], group_sizes))
+                faces_start = faces_end
+                corners_start = corners_end
+
+            self.mtllibs = mtllibs
+            self.mats = mats
+            self.vertices = arrays['vertices']
+            self.normals = arrays['normals']
+            self.groups = groups
+            return True
+        except (IOError, OSError, KeyError, TypeError, ValueError):
+            return False
+        finally:
+            f.close()
+
+    def _save_cache(self, filename):
+        """Writes the parsed model next to the file it came from. A cache that
+        can't be written is not an error, the model is just parsed again next
+        time"""
+        if self.groups:
+            corners = numpy.concatenate([c for _, c, _ in self.groups])
+            sizes = numpy.concatenate([s for _, _, s in self.groups])
+        else:
+            corners = numpy.empty((0, 2), dtype=int)
+            sizes = numpy.empty((0,), dtype=int)
+        arrays = [
+                ("vertices", self.vertices),
+                ("normals", self.normals),
+                ("corners", corners),
+                ("sizes", sizes),
+                ]
+
+        header = dict(
+                version=CACHE_VERSION,
+                stamps=self._stamps([filename] + self.mtllibs),
+                mtllibs=self.mtllibs,
+                mats=dict((name, [list(m.ambient), list(m.diffuse),
+                    list(m.specular), list(m.emission)])
+                    for name, m in self.mats.iteritems()),
+                groups=[(m, len(s)) for m, _, s in self.groups],
+                arrays=[(name, a.dtype.str, a.shape) for name, a in arrays],
+                )
+
+        # Write to a temporary file and move it into place, so a reader never
+        # sees a half written cache
+        cachename = filename + CACHE_SUFFIX
+        tmpname = "%s.%d.tmp" % (cachename, os.getpid())
+        try:
+            f = open(tmpname, 'wb')
+            try:
+                f.write(json.dumps(header) + "\n")
+                for _, a in arrays:
+                    f.write(numpy.ascontiguousarray(a).tostring())
+            finally:
+                f.close()
+            os.rename(tmpname, cachename)
+        except (IOError, OSError):
+            try:
+                os.remove(tmpname)
+            except OSError:
+                pass
+
+    def _pack(self, scale=1):
+        """Flattens the parsed faces into triangles.
+
+        Returns an array with a row for each triangle corner, holding its
+        normal and then its vertex, and a list of (material, first, count)
+        tuples giving the range of rows belonging to each material.
+
+        """
+        # Gather the groups of each material together, in the order the
+        # materials first appear
+        bymat = {}
+        order = []
+        for material, corners, sizes in self.groups:
+            if material not in bymat:
+                bymat[material] = []
+                order.append(material)
+            bymat[material].append(_triangulate(corners, sizes))
+
+        batches = []
+        tricorners = []
+        first = 0
+        for material in order:
+            corners = numpy.concatenate(bymat[material])
+            batches.append((self.mats.get(material), first, len(corners)))
+            tricorners.append(corners)
+            first += len(corners)
+
+        data = numpy.empty((first, 6), dtype=numpy.float32)
+        if tricorners:
+            tricorners = numpy.concatenate(tricorners)
+            data[:, :3] = self.normals[tricorners[:, 1]]
+            data[:, 3:] = self.vertices[tricorners[:, 0]] * scale
+        return data, batches
+
+    def _create_buffers(self, scale=1, upload=True):
+        """Create the vertex buffer.
+        Sub-classes *should* call this sometime during the initialization.
+        With upload False the triangles are only packed, and left in
+        self.pending for upload()
+        """
+        self.vbo = None
+        self.pending = None
+        if util.headless:
+            self.batches = []
+            return
+        self.pending, self.batches = self._pack(scale)
+        self._uploaded = 0
+        if upload:
+            self.upload()
+
+    def upload(self, limit=None):
+        """Sends up to limit bytes more of the packed triangles to the vertex
+        buffer, or all that are left. Returns how many bytes were sent.
+        Once they all have been, self.pending is None"""
+        data = self.pending
+        if data is None:
+            return 0
+        if self.vbo is None and limit is None:
+            # All at once
+            self.vbo = glGenBuffers(1)
+            glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+            glBufferData(GL_ARRAY_BUFFER, data.nbytes, data, GL_STATIC_DRAW)
+            glBindBuffer(GL_ARRAY_BUFFER, 0)
+            self.pending = None
+            return data.nbytes
+
+        if self.vbo is None:
+            self.vbo = glGenBuffers(1)
+            glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+            glBufferData(GL_ARRAY_BUFFER, data.nbytes, None, GL_STATIC_DRAW)
+        else:
+            glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        # Whole corners at a time, at least one
+        start = self._uploaded
+        end = len(data)
+        if limit is not None:
+            end = min(end, start + max(1, limit // self.STRIDE))
+        if end > start:
+            glBufferSubData(GL_ARRAY_BUFFER, start * self.STRIDE,
+                    (end - start) * self.STRIDE, data[start:end])
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+        self._uploaded = end
+        if end == len(data):
+            self.pending = None
+        return (end - start) * self.STRIDE
+
+    def _bind(self):
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glEnableClientState(GL_NORMAL_ARRAY)
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glNormalPointer(GL_FLOAT, self.STRIDE, ctypes.c_void_p(0))
+        glVertexPointer(3, GL_FLOAT, self.STRIDE, ctypes.c_void_p(12))
+
+    def _unbind(self):
+        glDisableClientState(GL_VERTEX_ARRAY)
+        glDisableClientState(GL_NORMAL_ARRAY)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def draw(self):
+        self._bind()
+        for material, first, count in self.batches:
+            if material:
+                material.activate()
+            fastgl.glDrawArrays(GL_TRIANGLES, first, count)
+        self._unbind()
+
+    def draw_instanced(self, instances):
+        """Draws the model the given number of times in one call per
+        material. Where each copy goes is up to the shader and per-instance
+        attributes the caller has set up"""
+        self._bind()
+        for material, first, count in self.batches:
+            if material:
+                material.activate()
+            glDrawArraysInstanced(GL_TRIANGLES, first, count, instances)
+        self._unbind()
+
+class SphereModel(ObjModel):
+    """A smooth shaded sphere, like glutSolidSphere, but generated into a
+    vertex buffer so it can be drawn instanced. It has no material of its
+    own, it's drawn with whatever material is current"""
+    def __init__(self, radius, slices, stacks):
+        # A vertex at each pole, and a ring of slices vertices at each of the
+        # stacks-1 latitudes in between
+        phi = numpy.pi * numpy.arange(1, stacks) / stacks
+        theta = 2 * numpy.pi * numpy.arange(slices) / slices
+        phi, theta = numpy.meshgrid(phi, theta, indexing='ij')
+        rings = numpy.column_stack((
+                (numpy.sin(phi) * numpy.cos(theta)).ravel(),
+                (numpy.sin(phi) * numpy.sin(theta)).ravel(),
+                numpy.cos(phi).ravel(),
+                ))
+        self.normals = numpy.vstack(([0, 0, 1], rings, [0, 0, -1]))
+        self.vertices = self.normals * radius
+        top = 0
+        bottom = len(self.vertices) - 1
+
+        def ring(i):
+            return 1 + i*slices + numpy.arange(slices)
+
+        faces = []
+        nextring = numpy.roll(numpy.arange(slices), -1)
+        first = ring(0)
+        for a, b in zip(first, first[nextring]):
+            faces.append((top, a, b))
+        for i in xrange(stacks - 2):
+            upper = ring(i)
+            lower = ring(i + 1)
+            for j in xrange(slices):
+                k = nextring[j]
+                faces.append((upper[j], lower[j], lower[k], upper[k]))
+        last = ring(stacks - 2)
+        for a, b in zip(last, last[nextring]):
+            faces.append((bottom, b, a))
+
+        # Each corner uses the vertex and normal of the same index
+        points = numpy.array([p for face in faces for p in face])
+        self.groups = [(None, numpy.column_stack((points, points)),
+            numpy.array([len(face) for face in faces]))]
+        self.mats = {}
+
+        self._create_buffers()
 
 class AsteroidModel(ObjModel):
     parsed = None
-    origverts = None
+    # Asteroids may be built on several asset threads at once
+    _parsing = threading.Lock()
 
-    def __init__(self):
+    def __init__(self, seed=None, upload=True):
         """Generate a randomized asteroid. Starts with a base asteroid.obj, and
-        randomly adjusts the magnitudes of all vertices"""
-        if AsteroidModel.parsed is None:
-            super(AsteroidModel, self)._parse_model("asteroid.obj")
-            AsteroidModel.parsed = dict(self.__dict__)
-            AsteroidModel.origverts = [v.copy() for v in self.vertices[1:]]
-        else:
-            self.__dict__ = dict(AsteroidModel.parsed)
-
-        # Since the vertices array holds objects that are also references by
-        # the polys array, we can't change the objects in the vertices array.
-        # But we can edit the values since numpy arrays are mutable
-        # So, edit the vertex objects in-place, which changes them for every
-        # instance, but it's okay since we take the snapshot into a displaylist
-        # right after
-        for vertex, origvertex in zip(self.vertices[1:], AsteroidModel.origverts):
-            vertex[:] = origvertex * random.uniform(0.7, 1.3)
+        randomly adjusts the magnitudes of all vertices.
 
-        super(AsteroidModel, self)._create_displaylist()
+        Given a seed, the same asteroid is generated every time.
 
+        """
+        with AsteroidModel._parsing:
+            if AsteroidModel.parsed is None:
+                super(AsteroidModel, self)._parse_model("asteroid.obj")
+                AsteroidModel.parsed = dict(self.__dict__)
+            else:
+                self.__dict__ = dict(AsteroidModel.parsed)
+
+        if seed is None:
+            rand = numpy.random
+        else:
+            rand = numpy.random.RandomState(seed)
+
+        # Faces refer to vertices by index, so scaling a vertex moves the
+        # corner of every face that shares it. This makes a new array, the
+        # shared parsed one is left alone
+        self.vertices = self.vertices * rand.uniform(0.7, 1.3,
+                size=(len(self.vertices), 1))
+
+        super(AsteroidModel, self)._create_buffers(upload=upload)
+
+# How many differently shaped asteroids there are
+ASTEROID_VARIANTS = 16
+
+class AsteroidVariants(object):
+    """A fixed set of randomized asteroid models shared by every asteroid.
+
+    Asteroids refer to a shape by its index, and get the rest of their variety
+    from their own scale and rotation. A shape is built the first time it's
+    asked for, or all of them at once by prebuild(), so creating an asteroid
+    never has to touch OpenGL. Each shape is generated from its index as the
+    seed, so it always comes out the same. The asset manager builds them in
+    the background.
+
+    """
+    def __init__(self, count=ASTEROID_VARIANTS):
+        self._models = [None] * count
+        for variant in xrange(count):
+            assets.register(("asteroid", variant), functools.partial(
+                AsteroidModel, seed=variant, upload=False))
+
+    def __len__(self):
+        return len(self._models)
+
+    def get(self, variant):
+        """Returns the model for the given variant index"""
+        m = self._models[variant]
+        if m is None:
+            m = self._models[variant] = assets.get(("asteroid", variant))
+        return m
+
+    def prebuild(self):
+        """Builds every variant now, so none has to be built mid-game"""
+        for variant in xrange(len(self)):
+            self.get(variant)
+
+# The shapes used by all asteroids
+asteroid_variants = AsteroidVariants()
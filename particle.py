@@ -2,82 +2,215 @@ from __future__ import division
 
 from OpenGL.GL import *
 import numpy
-from collections import deque
-import random
+
+import renderqueue
+import util
 
 """This file holds a particle class, which tends to several particle effects
 
-TODO: Rewrite this module as a C extension
+Particles live in preallocated ring buffers of positions, velocities, colors
+and remaining lifetimes. Each frame updates every particle with a handful of
+array operations, and emitting a burst of particles is a single slice
+assignment, no matter how many particles are involved.
 
 """
 
 SPARK_DEGRADE = numpy.array([0.01, 0.05, 0.05], dtype=float)
 DEBRIS_DEGRADE = numpy.array([0.05, 0.05, 0.05], dtype=float)
 
-class Particles(object):
-    def __init__(self):
-
-        # Spark particles, which degrade their color to black and then disappear.
-        # Each particle is a 3-tuple:
-        # (pos, vel, color)
-        self._sparks = deque(maxlen=70)
-        self._debris = deque(maxlen=50)
+# How many particles of each kind can be alive at once. When a buffer is full,
+# new particles replace the oldest ones
+MAX_SPARKS = 1024
+MAX_DEBRIS = 4096
+
+class ParticleBuffer(object):
+    """A fixed-size ring buffer of particles that fade by a constant amount
+    each frame until their lifetime runs out"""
+    def __init__(self, size, degrade):
+        self.size = size
+        self.degrade = degrade
+
+        self.pos = numpy.zeros((size, 3), dtype=float)
+        # Positions as of the tick before, for drawing in between ticks
+        self.prev_pos = numpy.zeros((size, 3), dtype=float)
+        self.vel = numpy.zeros((size, 3), dtype=float)
+        self.color = numpy.zeros((size, 3), dtype=float)
+        # Frames left to live. Slots at 0 or below are free to reuse
+        self.ttl = numpy.zeros((size,), dtype=int)
+
+        # Where the next particle will be written
+        self._next = 0
+
+    def emit(self, pos, vel, color, ttl):
+        """Adds particles. vel has one row per new particle. The other
+        arguments may have one row per particle too, or a single row to be
+        shared by all of them"""
+        count = len(vel)
+        pos = numpy.broadcast_to(pos, (count, 3))
+        color = numpy.broadcast_to(color, (count, 3))
+        ttl = numpy.broadcast_to(ttl, (count,))
+        if count > self.size:
+            # Only the newest ones would survive anyways
+            pos, vel, color, ttl = (a[-self.size:]
+                    for a in (pos, vel, color, ttl))
+            count = self.size
+
+        slots = (self._next + numpy.arange(count)) % self.size
+        self.pos[slots] = pos
+        self.prev_pos[slots] = pos
+        self.vel[slots] = vel
+        self.color[slots] = color
+        self.ttl[slots] = ttl
+        self._next = (self._next + count) % self.size
 
     def update(self):
+        # Dead slots get updated along with the rest. That's cheaper than
+        # picking out the live ones, and they're never drawn
+        self.pos += self.vel
+        self.color -= self.degrade
+        self.ttl -= 1
+
+    def remember(self):
+        self.prev_pos[:] = self.pos
+
+    def clear(self):
+        for a in (self.pos, self.prev_pos, self.vel, self.color, self.ttl):
+            a[:] = 0
+        self._next = 0
+
+    def live(self):
+        """Returns the indices of the particles still alive"""
+        return numpy.flatnonzero(self.ttl > 0)
+
+    def live_pos(self, live, alpha):
+        """Positions of the given live particles, alpha of the way from where
+        they were at the last remember() to where they are now"""
+        return util.interpolate(self.prev_pos[live], self.pos[live], alpha)
 
+class Particles(object):
+    def __init__(self, seed=None):
+        # Particles are only for show, so they draw from a random stream of
+        # their own. That way the game plays out the same whether or not
+        # anything is drawn
+        self.rng = numpy.random.RandomState(seed)
+
+        # Spark particles, which degrade their color to black and then
+        # disappear. They die once their red component has faded
+        self._sparks = ParticleBuffer(MAX_SPARKS, SPARK_DEGRADE)
+        # Debris particles, which die once all their color has faded
+        self._debris = ParticleBuffer(MAX_DEBRIS, DEBRIS_DEGRADE)
+
+    def update(self):
         # update pos and color
-        for pos, vel, color in self._sparks:
-            pos += vel
-            color -= SPARK_DEGRADE
-        for pos, vel, color in self._debris:
-            pos += vel
-            color -= DEBRIS_DEGRADE
-
-        # Prune dead particles
-        # XXX Could do this in an idle callback
-        while self._sparks and self._sparks[0][2][0] <= 0:
-            self._sparks.popleft()
-        while self._debris and numpy.all(self._debris[0][2] <= 0):
-            self._debris.popleft()
-
-    def draw(self):
-        # Draw all the particles on the screen
+        self._sparks.update()
+        self._debris.update()
+
+    def remember(self):
+        """Saves the current positions, to draw from after the next update"""
+        self._sparks.remember()
+        self._debris.remember()
+
+    def seed(self, seed):
+        """Restarts the random stream from the given seed"""
+        self.rng.seed(seed)
+
+    def clear(self):
+        """Removes every particle"""
+        self._sparks.clear()
+        self._debris.clear()
+
+    def save_state(self, w):
+        """Writes the state of the random stream to a snapshot.Writer. The
+        particles themselves are only for show and aren't saved"""
+        w.rng(self.rng)
+
+    def load_state(self, r):
+        """Restores the random stream from a snapshot.Reader, and removes
+        every particle"""
+        r.rng(self.rng)
+        self.clear()
+
+    def count(self):
+        """How many particles are alive"""
+        return (numpy.count_nonzero(self._sparks.ttl > 0) +
+                numpy.count_nonzero(self._debris.ttl > 0))
+
+    def points(self, alpha=1):
+        """Returns the positions and colors of the live particles of both
+        buffers, as two arrays with a row per particle. Positions are alpha
+        of the way from the last remember() to now"""
+        live_sparks = self._sparks.live()
+        live_debris = self._debris.live()
+        pos = numpy.concatenate((self._sparks.live_pos(live_sparks, alpha),
+            self._debris.live_pos(live_debris, alpha)))
+        color = numpy.concatenate((self._sparks.color[live_sparks],
+            self._debris.color[live_debris]))
+        return pos, color
+
+    def draw(self, alpha=1):
+        # Draw all the particles on the screen. The live particles of both
+        # buffers are sent in a single call, however many there are
+        pos, color = self.points(alpha)
+        if len(pos):
+            renderqueue.submit_call(self._draw_points, pos, color)
+
+    def _draw_points(self, pos, color):
+        count = len(pos)
         glMatrixMode(GL_MODELVIEW)
         glPointSize(1)
-        glBegin(GL_POINTS)
 
-        for pos, _, color in self._sparks:
-            glMaterial(GL_FRONT_AND_BACK, GL_AMBIENT_AND_DIFFUSE, color)
-            glVertex3dv(pos)
-        for pos, _, color in self._debris:
-            glMaterial(GL_FRONT_AND_BACK, GL_AMBIENT_AND_DIFFUSE, color)
-            glVertex3dv(pos)
+        # Each point's color stands in for its material, so the particles are
+        # lit the same way they would be by a glMaterial call per point
+        glColorMaterial(GL_FRONT_AND_BACK, GL_AMBIENT_AND_DIFFUSE)
+        glEnable(GL_COLOR_MATERIAL)
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_COLOR_ARRAY)
+
+        glVertexPointer(3, GL_DOUBLE, 0, pos)
+        glColorPointer(3, GL_DOUBLE, 0, color)
+        glDrawArrays(GL_POINTS, 0, count)
 
-        glEnd()
+        glDisableClientState(GL_COLOR_ARRAY)
+        glDisableClientState(GL_VERTEX_ARRAY)
+        glDisable(GL_COLOR_MATERIAL)
 
     def thrust(self, pos, direction):
         """Emits thrust particles from the given position in the given
         direction. direction should be normalized, but can have a different
         length to affect the speed.
-        
+
         """
-        for _ in xrange(random.randint(1, 3)):
-            vel = direction + numpy.random.normal(0, scale=0.2, size=(3,))
-            color = numpy.ones((3,))
-            self._sparks.append(
-                    (numpy.array(pos), vel, color)
-                    )
+        count = self.rng.randint(1, 4)
+        vel = direction + self.rng.normal(0, scale=0.2, size=(count, 3))
+        # Sparks start white and live until their red has faded
+        self._sparks.emit(pos, vel, 1,
+                int(numpy.ceil(1 / SPARK_DEGRADE[0])))
 
     def explosion(self, pos, color, initvel=numpy.array([0,0,0],dtype=float)):
-        for _ in xrange(random.randint(10,30)):
-            vel = numpy.random.uniform(-4,4, size=(3,)) + initvel
-            self._debris.append(
-                    (numpy.array(pos, dtype=float), vel, numpy.array(color,dtype=float))
-                    )
+        """Emits a burst of debris at pos. pos may also be an array of
+        positions, one per row, to set off that many explosions at once"""
+        pos = numpy.array(pos, dtype=float).reshape((-1, 3))
+        color = numpy.array(color, dtype=float)
+
+        # Each explosion gets its own number of particles
+        counts = self.rng.randint(10, 31, size=len(pos))
+        total = counts.sum()
+
+        vel = self.rng.uniform(-4, 4, size=(total, 3)) + initvel
+        # Debris lives until every component of its color has faded
+        ttl = int(numpy.ceil(numpy.max(color / DEBRIS_DEGRADE)))
+        self._debris.emit(numpy.repeat(pos, counts, axis=0), vel, color, ttl)
 
 # A global particles object
 particles = Particles()
 update = particles.update
+remember = particles.remember
+count = particles.count
+seed = particles.seed
+clear = particles.clear
+save_state = particles.save_state
+load_state = particles.load_state
+points = particles.points
 draw = particles.draw
 thrust = particles.thrust
 explosion = particles.explosion
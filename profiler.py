@@ -0,0 +1,147 @@
+from __future__ import division
+"""
+Times the phases of each frame.
+
+The game calls start() at the top of an update or a draw, and lap() as each
+phase of it finishes, which charges the time since the previous call to that
+phase. A frame is everything between two end_frame() calls: the draw and the
+ticks that ran before it. At the end of each frame the phase times and entity
+counts are kept for the rolling percentiles, and written out as a CSV row if
+a file was given.
+
+When not profiling, the game uses a NullProfiler, which does nothing at all.
+
+"""
+import collections
+import csv
+import timeit
+
+import numpy
+
+UPDATE_PHASES = ("asteroids", "enemies", "ship", "bullets", "collision",
+        "particles", "game_update")
+DRAW_PHASES = ("assets", "hud", "asteroids", "ship", "particles", "bullets",
+        "enemies", "render")
+
+# What Game.counts() returns, in order
+COUNTS = ("asteroids", "enemies", "bullets", "particles", "records",
+        "materials", "binds")
+
+# How many of the most recent frames the percentiles cover
+WINDOW = 300
+
+PERCENTILES = (50, 95, 99)
+
+_timer = timeit.default_timer
+
+class Profiler(object):
+    def __init__(self, csvfile=None, window=WINDOW):
+        """csvfile is a filename or file object to write a row per frame to,
+        or None"""
+        # Every phase, followed by the total of each kind of phase
+        self.phases = (["update_" + p for p in UPDATE_PHASES] +
+                ["draw_" + p for p in DRAW_PHASES] + ["update", "draw"])
+        self._column = dict((p, i) for i, p in enumerate(self.phases))
+        self._nupdate = len(UPDATE_PHASES)
+        self._ndraw = len(DRAW_PHASES)
+
+        # Seconds spent in each phase so far this frame
+        self._times = [0.0] * len(self.phases)
+        self._last = _timer()
+        self._ticks = 0
+
+        self.frame = 0
+        self._history = collections.deque(maxlen=window)
+
+        self._file = None
+        self._csv = None
+        if csvfile is not None:
+            if isinstance(csvfile, (str, unicode)):
+                csvfile = self._file = open(csvfile, 'wb')
+            self._csv = csv.writer(csvfile)
+            self._csv.writerow(["frame", "ticks"] + self.phases +
+                    list(COUNTS))
+
+    def start(self):
+        """Starts timing the first phase of an update or a draw"""
+        self._last = _timer()
+
+    def lap(self, phase):
+        """Ends the given phase, and starts timing the next"""
+        now = _timer()
+        self._times[self._column[phase]] += now - self._last
+        self._last = now
+
+    def tick(self):
+        """Counts a simulation tick towards the current frame"""
+        self._ticks += 1
+
+    def end_frame(self, game):
+        """Closes off the current frame, taking the entity counts from game"""
+        times = self._times
+        nupdate = self._nupdate
+        times[-2] = sum(times[:nupdate])
+        times[-1] = sum(times[nupdate:nupdate+self._ndraw])
+        counts = game.counts()
+
+        self._history.append(times + list(counts))
+        if self._csv is not None:
+            # Times are written in milliseconds
+            self._csv.writerow([self.frame, self._ticks] +
+                    ["%.4f" % (t * 1000) for t in times] + list(counts))
+
+        self.frame += 1
+        self._times = [0.0] * len(self.phases)
+        self._ticks = 0
+
+    def percentiles(self):
+        """Returns a dict mapping each phase to its (p50, p95, p99) over the
+        recent frames, in milliseconds"""
+        if not self._history:
+            return {}
+        history = numpy.array(self._history)[:, :len(self.phases)]
+        values = numpy.percentile(history * 1000, PERCENTILES, axis=0)
+        return dict((p, tuple(values[:, i])) for i, p in
+                enumerate(self.phases))
+
+    def report(self):
+        """Returns lines of text summarizing the recent frames"""
+        if not self._history:
+            return []
+        percentiles = self.percentiles()
+        lines = ["%-18s %7s %7s %7s" % (("ms",) +
+            tuple("p%d" % p for p in PERCENTILES))]
+        for phase in self.phases:
+            lines.append("%-18s %7.3f %7.3f %7.3f" % ((phase,) +
+                percentiles[phase]))
+        counts = self._history[-1][len(self.phases):]
+        lines.append("  ".join("%s %d" % (name, count) for name, count in
+            zip(COUNTS, counts)))
+        return lines
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+class NullProfiler(object):
+    """A stand-in for Profiler that records nothing"""
+    frame = 0
+
+    def start(self):
+        pass
+
+    def lap(self, phase):
+        pass
+
+    def tick(self):
+        pass
+
+    def end_frame(self, game):
+        pass
+
+    def report(self):
+        return []
+
+    def close(self):
+        pass
@@ -0,0 +1,226 @@
+from __future__ import division
+"""
+Draws games into small arrays of pixels with numpy, without OpenGL.
+
+This is for when a game has to be seen but there's no GL context: pixel
+observations for training, and pictures of headless runs. The picture is a
+flat, straight-down view of the field, not the game's perspective one, with
+nothing lit or shaded:
+    asteroids and aliens: filled discs of their collision radius
+    the ship: a triangle pointing along Ship.direction()
+    bullets and particles: single pixels
+
+Frames holds a stack of frames at once, so a BatchEnv's games can be drawn
+together. Each kind of shape is drawn for every frame in one pass of array
+operations: every shape gets a box of pixels around it, the pixels inside
+the shape are picked out with a mask, and they're all written in one go.
+Nothing loops over pixels or over shapes in Python.
+
+"""
+import numpy
+
+import bullets
+import enemy
+import particle
+import ship
+from asteroids import WIDTH, HEIGHT
+
+SIZE = (84, 84)
+
+ASTEROID_COLOR = (0.6, 0.6, 0.6)
+ALIEN_COLOR = (1, 0, 0)
+SHIP_COLOR = (0, 1, 0)
+# Bullets and particles have colors of their own. A BatchEnv's don't
+BULLET_COLOR = (0, 1, 0)
+ALIEN_BULLET_COLOR = (1, 0, 0)
+
+# The ship's triangle, as multiples of its radius along and across the way it
+# points: the tip, then the two back corners
+SHIP_SHAPE = ((1, 0), (-0.6, 0.6), (-0.6, -0.6))
+
+# How much each of red, green and blue counts towards gray
+_GRAY = numpy.array([0.299, 0.587, 0.114])
+
+class Frames(object):
+    """A stack of n frames, drawn into in the game's coordinates"""
+    def __init__(self, n, size=SIZE, rgb=False):
+        """size is (width, height) in pixels. Frames are RGB or gray"""
+        self.width, self.height = size
+        self.rgb = rgb
+        self.pixels = numpy.zeros((n, self.height, self.width,
+            3 if rgb else 1), dtype=numpy.uint8)
+        # Pixels per world unit
+        self._scale = numpy.array([self.width / WIDTH,
+            self.height / HEIGHT])
+
+    def frames(self):
+        """The frames, as an (n, height, width, 3) array if RGB, or
+        (n, height, width) if gray. Values go from 0 to 255"""
+        if self.rgb:
+            return self.pixels
+        return self.pixels[..., 0]
+
+    def clear(self):
+        self.pixels[...] = 0
+
+    def _pixels(self, pos):
+        """World positions to pixel coordinates, with y going down"""
+        pos = numpy.asarray(pos, dtype=float)[..., :2]
+        return numpy.stack((pos[..., 0], HEIGHT - pos[..., 1]),
+                axis=-1) * self._scale
+
+    def _value(self, color):
+        """Colors from 0 to 1 as pixel values, one row per color"""
+        color = numpy.clip(numpy.atleast_2d(color), 0, 1)
+        if not self.rgb:
+            color = color.dot(_GRAY)[:, numpy.newaxis]
+        return (color * 255 + 0.5).astype(numpy.uint8)
+
+    def _fill(self, frames, x, y, inside, color):
+        """Sets the pixels at x, y of the given frames where inside is true.
+        All of them are (shapes, ...) arrays, and color has a row per shape
+        or just the one"""
+        inside &= (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+        value = self._value(color)
+        if len(value) > 1:
+            value = numpy.broadcast_to(value[:, numpy.newaxis, numpy.newaxis],
+                    inside.shape + value.shape[1:])[inside]
+        frames = numpy.broadcast_to(frames[:, numpy.newaxis, numpy.newaxis],
+                inside.shape)
+        self.pixels[frames[inside], y[inside], x[inside]] = value
+
+    def _boxes(self, corner, size):
+        """Pixel coordinates of a size[0] by size[1] box of pixels from each
+        corner. Returns x and y as (shapes, rows, columns) arrays"""
+        corner = numpy.floor(corner).astype(int)
+        dy, dx = numpy.mgrid[:size[1], :size[0]]
+        return (corner[:, 0, numpy.newaxis, numpy.newaxis] + dx,
+                corner[:, 1, numpy.newaxis, numpy.newaxis] + dy)
+
+    def points(self, frames, pos, color):
+        """Sets one pixel at each of pos, in the frame of the same row of
+        frames"""
+        if not len(pos):
+            return
+        x, y = numpy.floor(self._pixels(pos)).astype(int).T
+        inside = numpy.ones(len(x), dtype=bool)
+        # _fill works on boxes, these are 1 by 1
+        new = numpy.newaxis
+        self._fill(numpy.asarray(frames), x[:, new, new], y[:, new, new],
+                inside[:, new, new], color)
+
+    def discs(self, frames, pos, radius, color):
+        """Fills a disc of each radius around each of pos. A disc too small
+        to cover a pixel's center still sets the one it's in"""
+        if not len(pos):
+            return
+        center = self._pixels(pos)
+        # Radii in pixels, across and down
+        r = numpy.asarray(radius, dtype=float)[:, numpy.newaxis] * self._scale
+        reach = numpy.ceil(r.max(axis=0)).astype(int)
+        x, y = self._boxes(center - reach, 2*reach + 1)
+
+        # Everything per shape, lined up with the boxes
+        new = numpy.newaxis
+        cx = center[:, 0, new, new]
+        cy = center[:, 1, new, new]
+        # Pixel centers' distances from the disc's center, in radii
+        dx = (x + 0.5 - cx) / r[:, 0, new, new]
+        dy = (y + 0.5 - cy) / r[:, 1, new, new]
+        inside = dx*dx + dy*dy <= 1
+        inside |= (x == numpy.floor(cx)) & (y == numpy.floor(cy))
+        self._fill(numpy.asarray(frames), x, y, inside, color)
+
+    def triangles(self, frames, corners, color):
+        """Fills triangles. corners is (triangles, 3, 2 or 3), in either
+        winding"""
+        if not len(corners):
+            return
+        corners = self._pixels(corners)
+        low = corners.min(axis=1)
+        extent = numpy.ceil((corners.max(axis=1) - low).max(axis=0))
+        x, y = self._boxes(low, extent.astype(int) + 2)
+        px = x + 0.5
+        py = y + 0.5
+
+        # Which side of each edge every pixel center is on. Inside is on
+        # the same side of all three
+        sides = []
+        for i in xrange(3):
+            a = corners[:, i, numpy.newaxis, numpy.newaxis, :]
+            b = corners[:, (i + 1) % 3, numpy.newaxis, numpy.newaxis, :]
+            sides.append((b[..., 0] - a[..., 0]) * (py - a[..., 1]) -
+                    (b[..., 1] - a[..., 1]) * (px - a[..., 0]))
+        sides = numpy.array(sides)
+        inside = (sides >= 0).all(axis=0) | (sides <= 0).all(axis=0)
+        self._fill(numpy.asarray(frames), x, y, inside, color)
+
+def ship_triangles(pos, direction):
+    """The corners of the ship's triangle at each of pos, pointing along
+    each of direction. Both are (ships, 2) or more columns"""
+    pos = numpy.asarray(pos, dtype=float)[:, :2]
+    along = numpy.asarray(direction, dtype=float)[:, :2] * ship.SHIP_RADIUS
+    across = numpy.column_stack((-along[:, 1], along[:, 0]))
+    return numpy.stack([pos + a*along + b*across for a, b in SHIP_SHAPE],
+            axis=1)
+
+def render(game, size=SIZE, rgb=False, frames=None):
+    """Draws a Game. Returns the frame, as Frames.frames() does. frames is a
+    Frames to draw into the first of, or None for a new one"""
+    if frames is None:
+        frames = Frames(1, size, rgb)
+    frames.clear()
+    first = numpy.zeros(1, dtype=int)
+
+    field = game.asteroids
+    frames.discs(first.repeat(len(field)), field.pos, field.radius,
+            ASTEROID_COLOR)
+
+    pos, color = particle.points()
+    frames.points(first.repeat(len(pos)), pos, color)
+
+    pool = bullets.pool
+    live = pool.live()
+    frames.points(first.repeat(len(live)), pool.pos[live],
+            pool.color[live, :3])
+
+    if game.enemies:
+        pos = numpy.array([alien.pos for alien in game.enemies])
+        radius = numpy.array([alien.radius for alien in game.enemies])
+        frames.discs(first.repeat(len(pos)), pos, radius, ALIEN_COLOR)
+
+    s = game.ship
+    if not s.is_dead():
+        frames.triangles(first, ship_triangles([s.pos], [s.direction()]),
+                SHIP_COLOR)
+
+    return frames.frames()[0]
+
+def render_batch(env, size=SIZE, rgb=False, frames=None):
+    """Draws every game of a batchenv.BatchEnv. Returns the frames, as
+    Frames.frames() does"""
+    if frames is None:
+        frames = Frames(env.n, size, rgb)
+    frames.clear()
+
+    games, slots = numpy.nonzero(env.ast_size > 0)
+    frames.discs(games, env.ast_pos[games, slots],
+            env.ast_radius[games, slots], ASTEROID_COLOR)
+
+    games, slots = numpy.nonzero(env.bullet_ttl > 0)
+    frames.points(games, env.bullet_pos[games, slots], BULLET_COLOR)
+    games, slots = numpy.nonzero(env.alien_bullet_ttl > 0)
+    frames.points(games, env.alien_bullet_pos[games, slots],
+            ALIEN_BULLET_COLOR)
+
+    games, slots = numpy.nonzero(env.alien_alive)
+    frames.discs(games, env.alien_pos[games, slots],
+            numpy.repeat(float(enemy.Alien1.radius), len(games)),
+            ALIEN_COLOR)
+
+    theta = numpy.radians(env.ship_theta)
+    direction = numpy.column_stack((-numpy.sin(theta), numpy.cos(theta)))
+    frames.triangles(numpy.arange(env.n),
+            ship_triangles(env.ship_pos, direction), SHIP_COLOR)
+
+    return frames.frames()
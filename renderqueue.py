@@ -0,0 +1,177 @@
+from __future__ import division
+"""
+Collects a frame's drawing and does it all at once, in an order that changes
+GL state as little as possible.
+
+Entities don't draw themselves straight away. Their draw methods submit
+records instead: a model, how to move it into place, a material, and whether
+it's blended. Drawing that sets itself up, like the instanced asteroids and
+the particles, is submitted as a call. Game.draw flushes the queue once
+everything is in, which sorts the records and draws them in one pass:
+
+    opaque before blended, so the shields go over everything they're in
+    front of, with blending turned on only once
+    models before calls
+    by material, and by model within each material
+
+Each piece of a model with its own material is its own record, so pieces of
+different models sharing a material are drawn together. A material is only
+sent when it differs from the one before, and a model's vertex buffer is only
+bound when it differs from the one bound already.
+
+stats() says what the last flush drew and how many times it changed state.
+
+"""
+from operator import itemgetter
+
+from OpenGL.GL import *
+
+import fastgl
+import model
+
+# The moves a transform is made of. A transform is a sequence of (move,
+# arguments) pairs, applied in order, e.g.
+#   ((TRANSLATE, pos), (ROTATE, (angle, 0, 0, 1)))
+TRANSLATE = 0
+ROTATE = 1
+SCALE = 2
+
+# What a record is drawn with
+_MODEL = 0
+_CALL = 1
+
+class RenderQueue(object):
+    def __init__(self):
+        self._records = []
+        # Small numbers standing in for this frame's materials and models,
+        # so the records sort on them
+        self._ids = {}
+        self.stats = dict(records=0, materials=0, binds=0)
+
+    def _id(self, thing):
+        if thing is None:
+            return 0
+        return self._ids.setdefault(thing, len(self._ids) + 1)
+
+    def _material(self, material):
+        """A color or a _Material, as something hashable"""
+        if material is None or isinstance(material, model._Material):
+            return material
+        return tuple(material)
+
+    def submit(self, obj, transform=(), material=None, blend=False):
+        """Queues a model to be drawn, moved into place by transform.
+        material is a _Material or an RGBA color for the pieces of the model
+        with no material of their own, or None to leave those with whatever
+        is current. Blended models are drawn without writing depth"""
+        material = self._material(material)
+        batches = getattr(obj, 'batches', None)
+        if batches is None:
+            # A display list, which may set materials of its own
+            self._add(blend, _CALL, material, None, None, transform,
+                    obj.draw, ())
+            return
+        model_id = self._id(obj)
+        for mat, first, count in batches:
+            self._add(blend, _MODEL, mat or material, obj, (first, count),
+                    transform, None, None, model_id)
+
+    def submit_call(self, func, *args, **kwargs):
+        """Queues func(*args) to draw something that sets up its own state.
+        Takes material and blend as keywords, as submit() does. func must
+        leave no vertex buffer bound, and whatever material it leaves current
+        is sent again before the next record"""
+        material = self._material(kwargs.pop('material', None))
+        blend = kwargs.pop('blend', False)
+        self._add(blend, _CALL, material, None, None, (), func, args)
+
+    def _add(self, blend, kind, material, obj, batch, transform, func, args,
+            model_id=0):
+        key = (bool(blend), kind, self._id(material), model_id)
+        self._records.append((key, material, obj, batch, transform, func,
+            args))
+
+    def clear(self):
+        self._records = []
+        self._ids = {}
+
+    def flush(self):
+        """Draws everything submitted since the last flush"""
+        records = self._records
+        self.clear()
+        records.sort(key=itemgetter(0))
+
+        # Looked up once, and each flush, in case fastgl.set_debug() has
+        # been called since
+        push = fastgl.glPushMatrix
+        pop = fastgl.glPopMatrix
+        draw = fastgl.glDrawArrays
+        moves = (fastgl.glTranslated, fastgl.glRotated, fastgl.glScaled)
+
+        glMatrixMode(GL_MODELVIEW)
+        blending = False
+        # The id of the current material, or -1 if nobody knows
+        current = -1
+        bound = None
+        materials = binds = 0
+        for key, material, obj, batch, transform, func, args in records:
+            if key[0] and not blending:
+                # Blended records come last, so this stays on
+                glDepthMask(GL_FALSE)
+                glEnable(GL_BLEND)
+                blending = True
+
+            if material is not None and key[2] != current:
+                if isinstance(material, model._Material):
+                    material.activate()
+                else:
+                    glMaterialfv(GL_FRONT, GL_AMBIENT_AND_DIFFUSE, material)
+                current = key[2]
+                materials += 1
+
+            if func is not None:
+                if bound is not None:
+                    bound._unbind()
+                    bound = None
+                if transform:
+                    push()
+                    for move, values in transform:
+                        moves[move](*values)
+                func(*args)
+                if transform:
+                    pop()
+                current = -1
+                continue
+
+            if obj is not bound:
+                if bound is not None:
+                    bound._unbind()
+                obj._bind()
+                bound = obj
+                binds += 1
+            push()
+            for move, values in transform:
+                moves[move](*values)
+            draw(GL_TRIANGLES, batch[0], batch[1])
+            pop()
+
+        if bound is not None:
+            bound._unbind()
+        if blending:
+            glDepthMask(GL_TRUE)
+            glDisable(GL_BLEND)
+
+        self.stats = dict(records=len(records), materials=materials,
+                binds=binds)
+
+queue = RenderQueue()
+
+submit = queue.submit
+submit_call = queue.submit_call
+flush = queue.flush
+clear = queue.clear
+
+def stats():
+    """What the last flush drew: its records, and how many times it sent a
+    material and bound a model"""
+    return queue.stats
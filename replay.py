@@ -0,0 +1,229 @@
+from __future__ import division, print_function
+"""
+Recording games and playing them back.
+
+A replay holds the seed a game started from and every key pressed or
+released, each tagged with the tick it came before. The game plays out the
+same for the same seed and input (see Game.__init__), so that's all it takes
+to play a whole game again. Every KEYFRAME_INTERVAL ticks a Game.snapshot() is
+written as well, so a player can jump to any tick by restoring the keyframe
+before it and stepping on from there, instead of from the very start.
+
+Playback is headless and runs as fast as the game can be stepped.
+
+File layout, all little-endian:
+    header: "ASTR", format version (uint16), seed (uint32), keyframe
+        interval (uint32)
+    then any number of records, each starting with a type byte:
+        'E': tick (uint32), event (uint8): the key's index in KEYS shifted
+            left by one, plus 1 if it was pressed or 0 if released
+        'K': tick (uint32), length (uint32), that many bytes of snapshot
+        'T': tick (uint32). The replay ends here
+
+Usage: python replay.py file [tick]
+
+Plays a replay up to tick, or to the end, and says how fast that went.
+
+"""
+import bisect
+import struct
+import sys
+import time
+
+# Just the constants, which unlike the rest of GLUT can be imported on any
+# platform
+from OpenGL.raw.GLUT.constants import GLUT_KEY_UP, GLUT_KEY_LEFT, \
+        GLUT_KEY_RIGHT
+
+import util
+
+MAGIC = "ASTR"
+VERSION = 2
+
+# Ticks between keyframes
+KEYFRAME_INTERVAL = 500
+
+# The keys that are recorded. Everything else doesn't affect the game
+KEYS = (GLUT_KEY_UP, GLUT_KEY_LEFT, GLUT_KEY_RIGHT, ' ')
+_KEY_INDEX = dict((key, i) for i, key in enumerate(KEYS))
+
+_HEADER = struct.Struct("<4sHII")
+_TICK = struct.Struct("<I")
+_EVENT = struct.Struct("<IB")
+_KEYFRAME = struct.Struct("<II")
+
+class Recorder(object):
+    """Records a game to a file as it's played"""
+    def __init__(self, fileobj, game, interval=KEYFRAME_INTERVAL):
+        """fileobj is a filename or a file object open for writing. Recording
+        starts from the game's current state"""
+        if isinstance(fileobj, (str, unicode)):
+            fileobj = open(fileobj, 'wb')
+        self.file = fileobj
+        self.interval = interval
+
+        self.file.write(_HEADER.pack(MAGIC, VERSION, game.seed, interval))
+        self._keyframe(game)
+
+        self.game = game
+        game.recorder = self
+
+    def _keyframe(self, game):
+        data = game.snapshot()
+        self.file.write("K" + _KEYFRAME.pack(game.ticks, len(data)))
+        self.file.write(data)
+        # So a crash loses at most one interval
+        self.file.flush()
+
+    def tick(self, game):
+        """Called by the game after each tick"""
+        if game.ticks % self.interval == 0:
+            self._keyframe(game)
+
+    def key(self, game, key, down):
+        """Called by the game when a key is pressed or released"""
+        index = _KEY_INDEX.get(key)
+        if index is None:
+            return
+        event = index << 1 | bool(down)
+        self.file.write("E" + _EVENT.pack(game.ticks, event))
+
+    def close(self):
+        """Ends the recording"""
+        if self.file is None:
+            return
+        self.file.write("T" + _TICK.pack(self.game.ticks))
+        self.file.close()
+        self.file = None
+        self.game.recorder = None
+
+class Replay(object):
+    """A replay file read into memory"""
+    def __init__(self, fileobj):
+        if isinstance(fileobj, (str, unicode)):
+            fileobj = open(fileobj, 'rb')
+        try:
+            data = fileobj.read()
+        finally:
+            fileobj.close()
+
+        magic, version, self.seed, self.interval = _HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a replay file, or the wrong version")
+
+        # Sorted lists of (tick, key index, pressed), and of keyframe ticks
+        # along with their snapshots
+        self.events = []
+        self.keyframe_ticks = []
+        self.keyframes = []
+        self.end = None
+
+        offset = _HEADER.size
+        last = 0
+        while offset < len(data):
+            kind = data[offset]
+            offset += 1
+            if kind == "E":
+                tick, event = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size
+                self.events.append((tick, event >> 1, bool(event & 1)))
+            elif kind == "K":
+                tick, length = _KEYFRAME.unpack_from(data, offset)
+                offset += _KEYFRAME.size
+                self.keyframe_ticks.append(tick)
+                self.keyframes.append(data[offset:offset+length])
+                offset += length
+            elif kind == "T":
+                tick, = _TICK.unpack_from(data, offset)
+                offset += _TICK.size
+                self.end = tick
+                break
+            else:
+                raise ValueError("Corrupt replay file")
+            last = tick
+
+        if self.end is None:
+            # The recording was cut short. Play as far as it got
+            self.end = last
+
+        if not self.keyframes:
+            raise ValueError("Replay has no keyframes")
+        self._event_ticks = [tick for tick, _, _ in self.events]
+
+    def first_event(self, tick):
+        """Index of the first event at or after tick"""
+        return bisect.bisect_left(self._event_ticks, tick)
+
+    def keyframe(self, tick):
+        """Returns the tick and snapshot of the last keyframe at or before
+        tick"""
+        i = bisect.bisect_right(self.keyframe_ticks, tick) - 1
+        if i < 0:
+            i = 0
+        return self.keyframe_ticks[i], self.keyframes[i]
+
+class Player(object):
+    """Plays a Replay back on a headless Game"""
+    def __init__(self, replay, game=None):
+        if not isinstance(replay, Replay):
+            replay = Replay(replay)
+        self.replay = replay
+
+        if game is None:
+            util.headless = True
+            import asteroids
+            game = asteroids.Game(seed=replay.seed)
+        self.game = game
+
+        keytick, snapshot = replay.keyframe(0)
+        game.restore(snapshot)
+        self._next = replay.first_event(keytick)
+
+    def done(self):
+        return self.game.ticks >= self.replay.end
+
+    def step(self):
+        """Plays the next tick"""
+        game = self.game
+        events = self.replay.events
+        while self._next < len(events) and events[self._next][0] <= game.ticks:
+            _, index, down = events[self._next]
+            if down:
+                game.keypress(KEYS[index], 0, 0)
+            else:
+                game.keyup(KEYS[index], 0, 0)
+            self._next += 1
+        game.step()
+
+    def seek(self, tick):
+        """Brings the game to the given tick. Restores the last keyframe
+        before it, unless the game is already between that keyframe and the
+        tick"""
+        tick = min(tick, self.replay.end)
+        keytick, snapshot = self.replay.keyframe(tick)
+        if not keytick <= self.game.ticks <= tick:
+            self.game.restore(snapshot)
+            self._next = self.replay.first_event(keytick)
+        while self.game.ticks < tick:
+            self.step()
+
+def main():
+    replay = Replay(sys.argv[1])
+    if len(sys.argv) > 2:
+        tick = int(sys.argv[2])
+    else:
+        tick = replay.end
+
+    start = time.time()
+    player = Player(replay)
+    player.seek(tick)
+    elapsed = time.time() - start
+
+    game = player.game
+    print("reached tick %d of %d in %.2fs" % (game.ticks, replay.end,
+        elapsed))
+    print("level %d, %d asteroids, %d enemies, %d lives" % (game.level,
+            len(game.asteroids), len(game.enemies), game.ship.lives))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+from __future__ import division, print_function
+"""
+Whole-game benchmarks, run headless and checked against a stored baseline.
+
+A scenario is a levels.Level to fill the field from, plus optionally a number
+of aliens already on the field and a number of explosions set off every
+frame. Each scenario is stepped for a number of frames in a fresh process, so
+its peak memory is its own, and the fastest of a few runs is reported:
+frames per second, percentiles of the time per frame and peak resident
+memory.
+
+Results are compared against BASELINE. A scenario whose frames per second
+has dropped by more than the tolerance counts as a regression, and the run
+exits with status 1. Baselines only mean something on the machine they were
+recorded on, so record a fresh one with --update before comparing changes.
+
+Usage: python scenarios.py [-f frames] [-r runs] [-t tolerance] [--update]
+                           [name ...]
+
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import timeit
+
+import numpy
+
+import util
+import levels
+
+# Where the baseline results are kept, next to this file
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        "scenarios_baseline.json")
+
+FRAMES = 2000
+RUNS = 5
+
+# How much slower than the baseline a scenario may get before it fails
+TOLERANCE = 0.25
+
+PERCENTILES = (50, 95, 99)
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows. Peak memory isn't reported there
+    resource = None
+
+_timer = timeit.default_timer
+
+class Scenario(object):
+    def __init__(self, name, level, aliens=0, explosions=0):
+        """level is the levels.Level whose asteroids the field starts with.
+        aliens is how many Alien1s start on the field, and explosions how
+        many explosions go off each frame"""
+        self.name = name
+        self.level = level
+        self.aliens = aliens
+        self.explosions = explosions
+
+    def setup(self, seed):
+        """Returns a new headless Game set up for this scenario"""
+        util.headless = True
+        import asteroids
+        import field
+        import enemy
+
+        game = asteroids.Game(seed=seed)
+
+        # Replace the first level's asteroids with ours
+        game.asteroids = field.AsteroidField(game.rng)
+        self.level.create_asteroids(game.asteroids)
+
+        for _ in xrange(self.aliens):
+            alien = enemy.Alien1(game.ship)
+            alien.pos[:2] = (game.rng.uniform(0, asteroids.WIDTH),
+                    game.rng.uniform(0, asteroids.HEIGHT))
+            game.enemies.append(alien)
+
+        # Where the explosions go off is up to the scenario, not the game
+        self._rng = numpy.random.RandomState(seed)
+        return game
+
+    def frame(self, game):
+        """Runs before each step"""
+        if self.explosions:
+            import asteroids
+            import particle
+            pos = numpy.zeros((self.explosions, 3))
+            pos[:, 0] = self._rng.uniform(0, asteroids.WIDTH,
+                    self.explosions)
+            pos[:, 1] = self._rng.uniform(0, asteroids.HEIGHT,
+                    self.explosions)
+            particle.explosion(pos, (1, 1, 1))
+
+SCENARIOS = [
+        Scenario("level3", levels.level[3]),
+        Scenario("asteroids500", levels.Level(1, [500], [])),
+        Scenario("aliens20", levels.Level(1, [0], []), aliens=20),
+        Scenario("explosions", levels.Level(1, [20, 10, 5], []),
+            explosions=5),
+        ]
+
+def _peak_memory():
+    """Peak resident memory of this process in bytes, or None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak
+    # Everywhere else it's in kilobytes
+    return peak * 1024
+
+def _run_once(scenario, frames, seed):
+    game = scenario.setup(seed)
+
+    times = numpy.empty(frames)
+    start = _timer()
+    for i in xrange(frames):
+        before = _timer()
+        scenario.frame(game)
+        game.step()
+        times[i] = _timer() - before
+    elapsed = _timer() - start
+
+    return dict(
+            fps=frames / elapsed,
+            frame_ms=dict(("p%d" % p, v * 1000) for p, v in
+                zip(PERCENTILES, numpy.percentile(times, PERCENTILES))),
+            )
+
+def _run_scenario(args):
+    """Runs one scenario several times, in a process of its own"""
+    name, frames, runs, seed = args
+    scenario = dict((s.name, s) for s in SCENARIOS)[name]
+    best = None
+    for _ in xrange(runs):
+        result = _run_once(scenario, frames, seed)
+        if best is None or result['fps'] > best['fps']:
+            best = result
+    best.update(frames=frames, runs=runs, peak_memory=_peak_memory())
+    return best
+
+def run(names=None, frames=FRAMES, runs=RUNS, seed=0):
+    """Runs the scenarios whose names are in names, or all of them. Returns a
+    dict mapping scenario names to results"""
+    results = {}
+    for scenario in SCENARIOS:
+        if names and scenario.name not in names:
+            continue
+        # A new process for each, so memory use doesn't carry over
+        pool = multiprocessing.Pool(1)
+        try:
+            results[scenario.name] = pool.apply(_run_scenario,
+                    ((scenario.name, frames, runs, seed),))
+        finally:
+            pool.terminate()
+            pool.join()
+    return results
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """Returns a list of (name, fps, baseline fps) for each scenario that got
+    slower than its baseline by more than tolerance"""
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        expected = baseline[name]['fps']
+        if result['fps'] < expected * (1 - tolerance):
+            regressions.append((name, result['fps'], expected))
+    return regressions
+
+def load_baseline(filename=BASELINE):
+    try:
+        f = open(filename, 'r')
+    except IOError:
+        return {}
+    try:
+        return json.load(f)
+    finally:
+        f.close()
+
+def save_baseline(results, filename=BASELINE):
+    f = open(filename, 'w')
+    try:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write("\n")
+    finally:
+        f.close()
+
+def main():
+    parser = argparse.ArgumentParser(
+            description="Run whole-game benchmarks and compare against "
+            "the baseline")
+    parser.add_argument("-f", "--frames", type=int, default=FRAMES)
+    parser.add_argument("-r", "--runs", type=int, default=RUNS)
+    parser.add_argument("-t", "--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument("--update", action="store_true",
+            help="record these results as the new baseline")
+    parser.add_argument("names", nargs="*",
+            help="only run these scenarios")
+    args = parser.parse_args()
+
+    # Models and their materials are found relative to the game's directory
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    results = run(args.names, args.frames, args.runs)
+    baseline = load_baseline()
+
+    for name, result in sorted(results.items()):
+        line = "%-14s %8.1f fps  p50 %.2fms  p95 %.2fms  p99 %.2fms" % (
+                name, result['fps'], result['frame_ms']['p50'],
+                result['frame_ms']['p95'], result['frame_ms']['p99'])
+        if result['peak_memory'] is not None:
+            line += "  peak %.1fMB" % (result['peak_memory'] / 2**20)
+        if name in baseline:
+            line += "  (baseline %.1f fps)" % baseline[name]['fps']
+        print(line)
+
+    if args.update:
+        baseline.update(results)
+        save_baseline(baseline)
+        return
+
+    regressions = compare(results, baseline, args.tolerance)
+    for name, fps, expected in regressions:
+        print("REGRESSION: %s at %.1f fps, baseline %.1f fps" % (name, fps,
+            expected))
+    if regressions:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
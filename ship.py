@@ -1,17 +1,20 @@
 from __future__ import division
 
 from OpenGL.GL import *
-from OpenGL.GLUT import *
 
+import functools
 import numpy
 import math
 
+import assets
 import entity
 import bullets
 import bezier
 import model
 from asteroids import WIDTH, HEIGHT, distance
 import particle
+import renderqueue
+import util
 
 SHIP_ACCEL = 0.1
 SHIP_ROTSPEED = 4
@@ -24,6 +27,9 @@ SHIP_FLYING_IN = 2
 SHIP_FLYING_OUT = 3
 
 SHIP_SCALE = 15
+SHIP_RADIUS = 2*SHIP_SCALE
+
+SHIP_SHIELDS = 5
 
 class Ship(entity.Entity):
     """Represents a player ship.
@@ -34,7 +40,7 @@ class Ship(entity.Entity):
 
     def __init__(self, hud, playernum=0):
         self.scale = SHIP_SCALE
-        super(Ship, self).__init__(model.ObjModel(self.modelfile), 2*self.scale)
+        super(Ship, self).__init__(assets.get(self.modelfile), SHIP_RADIUS)
 
         self.pos = numpy.array((WIDTH/2, HEIGHT/2, 0),dtype=float)
 
@@ -47,6 +53,9 @@ class Ship(entity.Entity):
         
         self.hud = hud
 
+        # The shield's sphere, made the first time it's drawn
+        self._shield_model = None
+
         # States:
         # 0 - control disabled, nothing happening
         # 1 - ship under normal control for in game
@@ -78,7 +87,7 @@ class Ship(entity.Entity):
         # The player's bullets
         self.bullets = bullets.Bullets()
 
-        self.shieldmax = 5
+        self.shieldmax = SHIP_SHIELDS
         self.shields = self.shieldmax
         self.hud.set_shields_max(self.shieldmax)
         self.hud.set_shields(self.shields)
@@ -92,6 +101,8 @@ class Ship(entity.Entity):
         # Automatic trigger?
         self.autofire = False
 
+        self.remember()
+
     def direction(self):
         """Computes the unit vector representing the ship's direction"""
         # Start with the ship's un-rotated direction, as a column vector
@@ -135,7 +146,8 @@ class Ship(entity.Entity):
         if self.autofire and self._trigger:
             self.fire()
 
-        # update bullets
+        # Count down to the next shot. The bullets themselves are moved by the
+        # shared pool
         self.bullets.update()
 
         if self._shield_vis > 0:
@@ -183,45 +195,82 @@ class Ship(entity.Entity):
             return
         self._turning = dir
 
-    def draw(self):
-        """Our own draw method, for alternate rotation"""
-        # Draw our bullets
-        self.bullets.draw()
+    def remember(self):
+        """Saves the current position and orientation, to draw from after the
+        next update"""
+        self._prev = (self.pos.copy(), self.theta, self.phi, self.rot)
 
+    def draw(self, alpha=1):
+        """Our own draw method, for alternate rotation. Draws the ship alpha
+        of the way from where it was at the last remember() to where it is
+        now"""
         if self._state == 4:
             return
 
-        glMatrixMode(GL_MODELVIEW)
-        glPushMatrix()
-
-        glTranslated(*self.pos)
-        glScaled(self.scale, self.scale, self.scale)
+        prev_pos, prev_theta, prev_phi, prev_rot = self._prev
 
-        # Do the rotations. The ship normally faces (0,1,0) into the page
-        # normal turn
-        glRotated(self.theta, 0,0,1)
+        scale = self.scale
+        transform = [
+                (renderqueue.TRANSLATE,
+                    util.interpolate(prev_pos, self.pos, alpha)),
+                (renderqueue.SCALE, (scale, scale, scale)),
+                # Do the rotations. The ship normally faces (0,1,0) into the
+                # page normal turn
+                (renderqueue.ROTATE,
+                    (util.interpolate(prev_theta, self.theta, alpha), 0,0,1)),
+                ]
 
-        phi = self.phi
+        phi = util.interpolate(prev_phi, self.phi, alpha)
         # skip common case: phi is 0
         if phi:
-            glRotated(phi, 1,0,0)
+            transform.append((renderqueue.ROTATE, (phi, 1,0,0)))
 
         # ship's axis rotation. Do this last, so it's always along the ship's
         # axis, not the world's Y axis
-        glRotated(self.rot, 0,1,0)
+        transform.append((renderqueue.ROTATE,
+            (util.interpolate(prev_rot, self.rot, alpha), 0,1,0)))
 
-        self.model.draw()
+        renderqueue.submit(self.model, transform)
 
-        # Draw shields
+        # Draw shields, see-through, over everything else
         if self._shield_vis > 0:
-            glMaterialfv(GL_FRONT, GL_AMBIENT_AND_DIFFUSE, (0,1,0,self._shield_vis,))
-            glDepthMask(GL_FALSE)
-            glEnable(GL_BLEND)
-            glutSolidSphere(2, 6, 6)
-            glDepthMask(GL_TRUE)
-            glDisable(GL_BLEND)
-
-        glPopMatrix()
+            if self._shield_model is None:
+                self._shield_model = model.SphereModel(2, 6, 6)
+            renderqueue.submit(self._shield_model, transform,
+                    (0,1,0,self._shield_vis), blend=True)
+
+    # theta, phi, rot, shield visibility and shields, then the state, lives,
+    # progress along the fly-in or out, the thrust, turn and trigger
+    # controls, autofire, and the weapon's cooldown and bullet owner
+    _STATE_FORMAT = "dddddiiibbb?ii"
+
+    def save_state(self, w):
+        """Writes everything about the ship that changes during a game to a
+        snapshot.Writer"""
+        w.values(self._STATE_FORMAT, self.theta, self.phi, self.rot,
+                self._shield_vis, self.shields, self._state, self.lives,
+                self._t, self._thrusting, self._turning, self._trigger,
+                self.autofire, self.bullets._cooldown, self.bullets.owner)
+        w.array((self.pos, self.speed), "<f8")
+        b = self._bezier
+        w.values("d", b.tmax)
+        w.array((b.p0, b.p1, b.p2), "<f8")
+
+    def load_state(self, r):
+        """Reads back what save_state() wrote, from a snapshot.Reader"""
+        (self.theta, self.phi, self.rot, self._shield_vis, self.shields,
+                self._state, self.lives, self._t, self._thrusting,
+                self._turning, self._trigger, self.autofire,
+                self.bullets._cooldown,
+                self.bullets.owner) = r.values(self._STATE_FORMAT)
+        self.pos, self.speed = r.array("<f8", (3,))
+        tmax, = r.values("d")
+        p0, p1, p2 = r.array("<f8", (5,))
+        self._bezier = bezier.Quadratic(p0, p1, p2, tmax)
+
+        self.hud.set_lives(self.lives)
+        self.hud.set_shields(self.shields)
+        self.remember()
 
     def _reset(self):
         """Resets movement parameters"""
@@ -357,3 +406,7 @@ class Ship(entity.Entity):
         velocity = self.bullets.speed * shipdirection + self.speed
 
         self.bullets.fire(self.pos, velocity)
+
+# Built in the background from startup. See assets.py
+assets.register(Ship.modelfile,
+        functools.partial(model.ObjModel, Ship.modelfile, upload=False))
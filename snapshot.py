@@ -0,0 +1,83 @@
+from __future__ import division
+"""
+Helpers for writing game state into a compact string of bytes and reading it
+back, as used by Game.snapshot() and Game.restore().
+
+A snapshot is nothing but fixed-size groups of numbers packed with struct and
+numpy arrays copied out byte for byte, one after another, little-endian
+throughout. Nothing describes its own layout: each piece of the game reads
+back exactly what it wrote, in the same order. That keeps it small, and fast
+enough to take every frame.
+
+"""
+import struct
+
+import numpy
+
+_COUNT = struct.Struct("<I")
+
+# Compiled struct formats, by format string
+_structs = {}
+
+def _struct(fmt):
+    s = _structs.get(fmt)
+    if s is None:
+        s = _structs[fmt] = struct.Struct("<" + fmt)
+    return s
+
+class Writer(object):
+    def __init__(self):
+        self._parts = []
+
+    def values(self, fmt, *values):
+        """Packs values with the struct format fmt, which is little-endian
+        regardless of any byte order character"""
+        self._parts.append(_struct(fmt).pack(*values))
+
+    def array(self, a, dtype):
+        """Writes an array of any length. Its shape past the first dimension
+        must be known to the reader"""
+        a = numpy.ascontiguousarray(a, dtype=dtype)
+        self._parts.append(_COUNT.pack(len(a)))
+        self._parts.append(a.tostring())
+
+    def rng(self, rng):
+        """Writes the state of a numpy RandomState"""
+        _, keys, pos, has_gauss, cached_gaussian = rng.get_state()
+        self.values("iid", pos, has_gauss, cached_gaussian)
+        self.array(keys, "<u4")
+
+    def getvalue(self):
+        return "".join(self._parts)
+
+class Reader(object):
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def values(self, fmt):
+        """Unpacks a tuple of values written with the same format"""
+        s = _struct(fmt)
+        values = s.unpack_from(self.data, self.offset)
+        self.offset += s.size
+        return values
+
+    def array(self, dtype, shape=()):
+        """Reads an array written by Writer.array. shape is its shape past the
+        first dimension. The result is a new array, safe to modify"""
+        dtype = numpy.dtype(dtype)
+        count, = _COUNT.unpack_from(self.data, self.offset)
+        self.offset += _COUNT.size
+        items = count
+        for n in shape:
+            items *= n
+        a = numpy.frombuffer(self.data, dtype, items, self.offset)
+        self.offset += items * dtype.itemsize
+        # Back to native byte order, in an array of its own
+        return a.astype(dtype.newbyteorder("=")).reshape((count,) + shape)
+
+    def rng(self, rng):
+        """Restores a numpy RandomState written by Writer.rng"""
+        pos, has_gauss, cached_gaussian = self.values("iid")
+        keys = self.array("<u4")
+        rng.set_state(("MT19937", keys, pos, has_gauss, cached_gaussian))
@@ -1,8 +1,30 @@
 from OpenGL.GL import glGenLists
 
+import numpy
+
+# When set, nothing is allowed to touch OpenGL. Models skip compiling their
+# display lists and the HUD draws nothing, so a Game can be created and
+# stepped without a window. See headless.py
+headless = False
+
+# Anything that moves further than this in a single tick was put there, by
+# wrapping around the edge of the field or starting a fly-in, rather than
+# moving there
+JUMP = 100
+
 def get_displaylist():
     new_list = glGenLists(1)
     if new_list == 0:
         raise RuntimeError("Could not allocate a display list")
     return new_list
 
+def interpolate(previous, current, alpha, jump=JUMP):
+    """Returns the value alpha of the way from previous to current. Works on
+    numbers and arrays alike. Values that jumped further than jump are drawn
+    where they are now, instead of sliding across the screen"""
+    if alpha >= 1:
+        return current
+    delta = current - previous
+    delta = numpy.where(abs(delta) > jump, 0, delta)
+    return current - (1 - alpha) * delta
+